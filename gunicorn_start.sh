@@ -25,6 +25,18 @@ export PYTHONPATH=$DJANGODIR:$PYTHONPATH
 RUNDIR=`dirname $SOCKFILE`
 test -d $RUNDIR || mkdir -p $RUNDIR
 
+# worker of the run, simulate and loaddata jobs queued by the pages, and one of the live runs only so that
+# trading never waits behind a simulation. the workers of the last start are stopped first,
+# run_jobs waits on its lock file until the old one has exited
+JOBS_PIDFILE=${RUNDIR}/run_jobs.pid
+test -f $JOBS_PIDFILE && kill `cat $JOBS_PIDFILE` 2> /dev/null
+python3 manage.py run_jobs >> ${DJANGODIR}/logs/jobs.log 2>&1 &
+echo $! > $JOBS_PIDFILE
+LIVE_JOBS_PIDFILE=${RUNDIR}/run_jobs_live.pid
+test -f $LIVE_JOBS_PIDFILE && kill `cat $LIVE_JOBS_PIDFILE` 2> /dev/null
+python3 manage.py run_jobs --live >> ${DJANGODIR}/logs/jobs.log 2>&1 &
+echo $! > $LIVE_JOBS_PIDFILE
+
 exec /usr/local/bin/gunicorn ${DJANGO_WSGI_MODULE}:application \
 	--name $NAME \
 	--workers $NUM_WORKERS \
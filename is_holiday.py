@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 
 from datetime import date
-import holidays
+from stock.trading_calendar import is_holiday
 
 
 if __name__ == '__main__':
-    us_holidays = holidays.UnitedStates()
-
-    if date.today() in us_holidays:
+    if is_holiday(date.today()):
         exit(0)
 
     exit(-1)
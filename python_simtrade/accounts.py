@@ -20,8 +20,9 @@ from . import stocks
 
 
 class Account:
-    def __init__(self, id, dt):
+    def __init__(self, id, dt, prices=None):
         self.id = id
+        self.prices = prices
         self.net_value = None
         self.cash_to_trade = None
         self.stock_list = []
@@ -18,7 +18,7 @@
 import json
 import logging
 from .accounts import Account
-from .stocks import Stock, Quote
+from .stocks import Stock, Quote, PriceCache
 from os.path import dirname, realpath, join
 
 
@@ -26,7 +26,7 @@ SIM_CONFIG_FILE = join(dirname(realpath(__file__)), 'sim_config.json')
 SIM_INITIAL_VALUE = 100000.0
 
 
-def reset_sim_config():
+def new_sim_config():
     config = dict()
     config['accounts'] = [
         {'id': 0, 'cash_to_trade': SIM_INITIAL_VALUE, 'stocks': []},
@@ -41,38 +41,42 @@ def reset_sim_config():
         {'id': 9, 'cash_to_trade': SIM_INITIAL_VALUE, 'stocks': []},
     ]
 
-    with open(SIM_CONFIG_FILE, 'w') as outfile:
-        json.dump(config, outfile, indent=2, sort_keys=False)
+    return config
 
 
 class Client:
-    def __init__(self):
+    # the state lives in SIM_CONFIG_FILE unless a config is given, then it is kept in memory only
+    def __init__(self, config=None):
         self.current_time = None
-        self.config = None
+        self.config = config
+        self.in_memory = config is not None
         self.account_dict = {}
+        self.prices = PriceCache()
 
     def login(self, dt):
-        try:
-            with open(SIM_CONFIG_FILE) as f:
-                self.config = json.load(f)
-        except FileNotFoundError:
-            self.config = dict()
-            self.config['accounts'] = []
+        if not self.in_memory:
+            try:
+                with open(SIM_CONFIG_FILE) as f:
+                    self.config = json.load(f)
+            except FileNotFoundError:
+                self.config = dict()
+                self.config['accounts'] = []
 
-            with open(SIM_CONFIG_FILE, 'w') as outfile:
-                json.dump(self.config, outfile, indent=2, sort_keys=False)
+                with open(SIM_CONFIG_FILE, 'w') as outfile:
+                    json.dump(self.config, outfile, indent=2, sort_keys=False)
 
         self.current_time = dt
+        self.prices.load()
 
         for json_account in self.config['accounts']:
-            account = Account(json_account['id'], self.current_time)
+            account = Account(json_account['id'], self.current_time, self.prices)
             self.account_dict[account.id] = account
             account.cash_to_trade = json_account['cash_to_trade']
 
             for json_stock in json_account['stocks']:
                 stock = Stock(json_stock['symbol'], account)
                 quote = Quote(stock.symbol)
-                quote.update(dt)
+                quote.update(dt, self.prices)
                 stock.value = quote.ask
                 stock.count = json_stock['count']
 
@@ -111,8 +115,9 @@ class Client:
         logging.debug('\nlogout sim client')
         logging.debug('config' + str(self.config))
 
-        with open(SIM_CONFIG_FILE, 'w') as outfile:
-            json.dump(self.config, outfile, indent=2, sort_keys=False)
+        if not self.in_memory:
+            with open(SIM_CONFIG_FILE, 'w') as outfile:
+                json.dump(self.config, outfile, indent=2, sort_keys=False)
         return True
 
     def get_account(self, account_id):
@@ -120,7 +125,7 @@ class Client:
 
     def get_quote(self, symbol):
         quote = Quote(symbol)
-        if not quote.update(self.current_time):
+        if not quote.update(self.current_time, self.prices):
             return None
 
         if quote.ask is None:
@@ -15,8 +15,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
 
-from django.utils import timezone
+from bisect import bisect_right
+import numpy as np
 import stock.models as models
+import stock.columnar as columnar
 import logging
 
 
@@ -24,20 +26,72 @@ TRANSACTION_FEE = 6.95
 logger = logging.getLogger('simulation')
 
 
+class PriceCache:
+    # sorted dates and opens per symbol, loaded from SimHistory once per run at the login of the client
+    def __init__(self):
+        self.series = dict()
+
+    def load(self):
+        series = dict()
+
+        if columnar.enabled():
+            # the date and open columns of the mapped store, no copy
+            for symbol in columnar.list_symbols():
+                bars = columnar.open_symbol(symbol)
+                if bars is not None:
+                    series[symbol] = (bars['date'], bars['open'])
+            logging.debug('price cache: mapped %d symbols' % len(series))
+
+        # the symbols the store has no file for (yet) come from SimHistory
+        histories = models.SimHistory.objects.exclude(symbol__in=list(series))\
+            .order_by('symbol', 'date').values_list('symbol', 'date', 'open')
+        for symbol, date, open in histories.iterator():
+            if symbol not in series:
+                series[symbol] = ([], [])
+            dates, opens = series[symbol]
+            dates.append(date)
+            opens.append(open)
+
+        self.series = series
+        logging.debug('price cache: loaded %d symbols' % len(series))
+
+    def get_price(self, symbol, date):
+        try:
+            dates, opens = self.series[symbol]
+        except KeyError:
+            return None
+
+        if isinstance(dates, np.ndarray):
+            n = int(np.searchsorted(dates, np.datetime64(date, 'D'), side='right'))
+        else:
+            n = bisect_right(dates, date)
+        if n == 0:
+            return None
+
+        return float(opens[n - 1])
+
+
 class Quote:
     def __init__(self, symbol):
         self.symbol = symbol
         self.ask = None
         self.bid = None
 
-    def update(self, cur_time):
-        try:
-            history = models.SimHistory.objects.filter(symbol=self.symbol, date__lte=cur_time.date()).order_by('-date')[0]
-        except IndexError:
-            print('update error')
-            return False
-        self.ask = history.open
-        self.bid = history.open
+    def update(self, cur_time, prices=None):
+        if prices is not None:
+            price = prices.get_price(self.symbol, cur_time.date())
+            if price is None:
+                logging.debug('update error: %s' % self.symbol)
+                return False
+        else:
+            try:
+                history = models.SimHistory.objects.filter(symbol=self.symbol, date__lte=cur_time.date()).order_by('-date')[0]
+            except IndexError:
+                print('update error')
+                return False
+            price = history.open
+        self.ask = price
+        self.bid = price
 
         logging.debug('quote: %s' % self.symbol)
         logging.debug('ask: %f' % self.ask)
@@ -71,7 +125,7 @@ class Stock:
 
     def update(self, dt):
         quote = Quote(self.symbol)
-        res = quote.update(dt)
+        res = quote.update(dt, self.account.prices)
         if not res:
             logging.debug('failed to update Quote')
             self.valid = False
@@ -47,7 +47,22 @@ class DayReportAdmin(admin.ModelAdmin):
     ordering = ('-date', 'account_id')
 
 
+class SimulationRunAdmin(admin.ModelAdmin):
+    ordering = ('-id',)
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'total', 'created', 'finished')
+    ordering = ('-id',)
+
+
+class RunTraceAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'started', 'seconds', 'queries')
+    ordering = ('-id',)
+
+
 admin.site.register(OrderID)
+admin.site.register(Position)
 admin.site.register(Quote)
 admin.site.register(Stock)
 admin.site.register(DayHistory, DayHistoryAdmin)
@@ -55,3 +70,6 @@ admin.site.register(SimHistory, SimHistoryAdmin)
 admin.site.register(Account, AccountAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(DayReport, DayReportAdmin)
+admin.site.register(SimulationRun, SimulationRunAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(RunTrace, RunTraceAdmin)
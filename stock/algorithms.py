@@ -18,7 +18,9 @@
 import logging
 import pickle
 import random
-from . import models
+from .marketdata import load_history_window
+from .indicators import RollingRange, WeightedMomentum
+from . import positions
 from os.path import realpath, dirname, join
 
 
@@ -45,8 +47,35 @@ def sell_all(stock):
     return -stock.count
 
 
+def get_histories(stock, period):
+    # run() and the backtest engine hand over the history on the stock object, otherwise it is read from DayHistory
+    if hasattr(stock, 'history'):
+        return stock.history.latest(period)
+
+    return load_history_window(stock.symbol, period)
+
+
+def get_indicator(stock, indicator_class, period, histories):
+    # run() and the backtest engine keep the indicators over the days, otherwise it is built from the window
+    indicators = getattr(stock, 'indicators', None)
+    if indicators is None:
+        indicator = indicator_class(period)
+        indicator.advance(histories)
+        return indicator
+
+    return indicators.get(indicator_class, stock.symbol, period, histories)
+
+
+def get_entry_price(stock):
+    if hasattr(stock, 'entry_price'):
+        return stock.entry_price
+
+    return positions.get_entry_price(stock.account.id, stock.symbol)
+
+
 class TradeAlgorithm:
     name = None
+    history_period = 0      # the most DayHistory bars the algorithm reads
 
     def trade_decision(self, stock, time_now=None):
         return 0
@@ -129,6 +158,7 @@ up_variables = (
 
 class UpAlgorithm(TradeAlgorithm):
     name = 'ConsecutiveUp'
+    history_period = max(v['consecutive_up'] for v in up_variables)
 
     def trade_decision(self, stock):
         if stock.count:
@@ -138,14 +168,15 @@ class UpAlgorithm(TradeAlgorithm):
 
         logger.debug('evaluating: %s' % stock.symbol)
 
-        histories = models.DayHistory.objects.filter(symbol=stock.symbol).order_by('-date')[0:consecutive_up]
+        histories = get_histories(stock, consecutive_up)
 
         if len(histories) < consecutive_up:
             logger.info('not enough history yet')
             return 0
 
+        opens = histories.open
         for i in range(len(histories) - 1):
-            if histories[i].open < histories[i+1].open:
+            if opens[i] < opens[i+1]:
                 return 0
 
         return buy_all(stock)
@@ -171,21 +202,17 @@ class AhnyungAlgorithm(TradeAlgorithm):
 
         logger.debug('evaluating: %s' % stock.symbol)
 
-        try:
-            order = models.Order.objects.filter(
-                symbol=stock.symbol,
-                account_id=stock.account.id,
-                action=models.ACTION_BUY).order_by('-dt')[0]
-        except IndexError:
+        entry_price = get_entry_price(stock)
+        if entry_price is None:
             logger.info('there is no order information yet')
             return 0
 
-        print('value=%f, prev_buy=%f' % (stock.value, order.price))
+        logger.debug('value=%f, prev_buy=%f' % (stock.value, entry_price))
 
-        if (order.price * out_rate) < stock.value:
+        if (entry_price * out_rate) < stock.value:
             return sell_all(stock)
 
-        if (order.price * emergency_rate) > stock.value:
+        if (entry_price * emergency_rate) > stock.value:
             return sell_all(stock)
 
         return 0
@@ -201,6 +228,7 @@ vertex_variable = (
 
 class VertexAlgorithm(TradeAlgorithm):
     name = 'Vertex'
+    history_period = max(v['period'] for v in vertex_variable)
 
     def trade_decision(self, stock):
         if stock.count:
@@ -212,7 +240,7 @@ class VertexAlgorithm(TradeAlgorithm):
 
         logger.debug('evaluating: %s' % stock.symbol)
 
-        histories = models.DayHistory.objects.filter(symbol=stock.symbol).order_by('-date')[0:period]
+        histories = get_histories(stock, period)
 
         if len(histories) < period:
             logger.info('not enough history yet')
@@ -221,12 +249,8 @@ class VertexAlgorithm(TradeAlgorithm):
         logger.debug('stock info: %s' % str(stock))
         logger.debug('last day market data: %s' % str(histories[0]))
 
-        weight = 1
-        weight_decrease = weight / period
-        new_rate = (stock.value - histories[0].open) * weight
-        for i in range(len(histories) - 2):
-            weight -= weight_decrease
-            new_rate += (histories[i].open - histories[i+1].open) * weight
+        momentum = get_indicator(stock, WeightedMomentum, period, histories)
+        new_rate = momentum.rate(stock.value)
 
         if stock.count and new_rate < (-rate * stock.value):
             return sell_all(stock)
@@ -247,6 +271,7 @@ range_variable = (
 
 class RangeAlgorithm(TradeAlgorithm):
     name = 'Range'
+    history_period = max(v['period'] for v in range_variable)
 
     def trade_decision(self, stock):
         logger.debug('evaluatating: %s' % stock.symbol)
@@ -258,7 +283,7 @@ class RangeAlgorithm(TradeAlgorithm):
         else:
             period = range_variable[stock.in_stance]['period']
 
-        histories = models.DayHistory.objects.filter(symbol=stock.symbol).order_by('-date')[0:period]
+        histories = get_histories(stock, period)
 
         if len(histories) < period:
             logger.info('not enough history yet')
@@ -267,13 +292,9 @@ class RangeAlgorithm(TradeAlgorithm):
         logger.debug('stock info: %s' % str(stock))
         logger.debug('last day market data: %s' % str(histories[0]))
 
-        period_high = histories[0].high
-        period_low = histories[0].low
-        for history in histories:
-            if history.high > period_high:
-                period_high = history.high
-            if history.low < period_low:
-                period_low = history.low
+        period_range = get_indicator(stock, RollingRange, period, histories)
+        period_high = period_range.high()
+        period_low = period_range.low()
 
         period_in = period_low + (period_high - period_low) * in_rate
         period_out = period_low + (period_high - period_low) * out_rate
@@ -20,3 +20,8 @@ from django.apps import AppConfig
 
 class StockConfig(AppConfig):
     name = 'stock'
+
+    def ready(self):
+        # connects the report cache invalidation and the FailureReason cache signals
+        from . import cache
+        from . import unitofwork
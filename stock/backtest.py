@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import logging
+import itertools
+import numpy as np
+import python_simtrade.accounts as simaccounts
+import python_simtrade.stocks as simstocks
+
+from . import models
+from . import trading_calendar
+from . import tracing
+from concurrent.futures import ProcessPoolExecutor
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+from django.db import connections, transaction
+from .algorithms import in_algorithm_list, out_algorithm_list
+from .marketdata import MarketData, MIN_HISTORY_DAYS
+from .indicators import IndicatorSet
+from python_simtrade.client import SIM_INITIAL_VALUE
+
+
+logger = logging.getLogger('backtest')
+
+# calendar days loaded before the start date so that the first day already has enough history
+LOOKBACK_DAYS = 2 * MIN_HISTORY_DAYS
+# finished simulation runs kept in the database, older ones are deleted
+SIM_RUNS_TO_KEEP = 20
+
+
+class StockSpec:
+    def __init__(self, account_id, symbol, share, in_algorithm, in_stance, out_algorithm, out_stance):
+        self.account_id = account_id
+        self.symbol = symbol
+        self.share = share
+        self.in_algorithm = in_algorithm
+        self.in_stance = in_stance
+        self.out_algorithm = out_algorithm
+        self.out_stance = out_stance
+
+    @classmethod
+    def from_db(cls, db_stock):
+        return cls(db_stock.account_id, str(db_stock.symbol), db_stock.share,
+                   db_stock.in_algorithm, db_stock.in_stance, db_stock.out_algorithm, db_stock.out_stance)
+
+    def override(self, in_algorithm=None, in_stance=None, out_algorithm=None, out_stance=None):
+        # a copy with the given choices in place of the stock's own, None keeps the stock's
+        return StockSpec(self.account_id, self.symbol, self.share,
+                         self.in_algorithm if in_algorithm is None else in_algorithm,
+                         self.in_stance if in_stance is None else in_stance,
+                         self.out_algorithm if out_algorithm is None else out_algorithm,
+                         self.out_stance if out_stance is None else out_stance)
+
+
+def load_specs(overrides=None):
+    # the stocks of the accounts, with the choices of overrides (a dict of the override() arguments) if given
+    specs = []
+    for db_account in models.Account.objects.all():
+        for db_stock in models.Stock.objects.filter(account=db_account):
+            spec = StockSpec.from_db(db_stock)
+            if overrides:
+                spec = spec.override(**overrides)
+            specs.append(spec)
+
+    return specs
+
+
+class BacktestOrder:
+    def __init__(self, dt, account_id, symbol, count, price, action, failure_reason):
+        self.dt = dt
+        self.account_id = account_id
+        self.symbol = symbol
+        self.count = count
+        self.price = price
+        self.action = action
+        self.failure_reason = failure_reason
+
+
+class BacktestResult:
+    def __init__(self, account_ids, dates):
+        self.account_ids = list(account_ids)
+        self.dates = list(dates)
+        self.net_values = np.zeros((len(self.account_ids), len(self.dates)))
+        self.cash_to_trade = np.zeros((len(self.account_ids), len(self.dates)))
+        self.orders = []
+        self.accounts = dict()
+
+    def total_net_values(self):
+        return self.net_values.sum(axis=0)
+
+    def max_drawdown(self):
+        net_values = self.total_net_values()
+        if not len(net_values):
+            return 0.0
+        peaks = np.maximum.accumulate(net_values)
+        drawdowns = (peaks - net_values) / np.where(peaks > 0, peaks, 1.0)
+        return float(drawdowns.max())
+
+    def trade_count(self):
+        count = 0
+        for order in self.orders:
+            if order.action in (models.ACTION_BUY, models.ACTION_SELL):
+                count += 1
+        return count
+
+
+def sim_datetime(date):
+    return timezone.datetime(year=date.year, month=date.month, day=date.day,
+                             hour=9, minute=31, second=0, tzinfo=timezone.get_default_timezone())
+
+
+class Backtest:
+    # runs the in/out algorithms of main.run() day by day over arrays loaded once from SimHistory
+    def __init__(self, market, specs, start_date, end_date, initial_cash=SIM_INITIAL_VALUE, trace=None):
+        self.market = market
+        self.specs = specs
+        self.start_date = start_date
+        self.end_date = end_date
+        self.initial_cash = initial_cash
+        self.trace = trace
+
+    def run(self, progress=None):
+        # progress(done, total) is called after every simulated day
+        market = self.market
+
+        account_specs = dict()
+        for spec in self.specs:
+            account_specs.setdefault(spec.account_id, []).append(spec)
+
+        start_col = max(market.col(self.start_date), 0)
+        end_col = min(market.col(self.end_date), market.n_days - 1)
+        dates = [market.date(col) for col in range(start_col, end_col + 1)]
+
+        result = BacktestResult(account_specs.keys(), dates)
+
+        accounts = dict()
+        for account_id in account_specs:
+            account = simaccounts.Account(account_id, None)
+            account.cash_to_trade = self.initial_cash
+            account.net_value = self.initial_cash
+            accounts[account_id] = account
+        result.accounts = accounts
+
+        in_algorithms = [alg() for alg in in_algorithm_list]
+        out_algorithms = [alg() for alg in out_algorithm_list]
+        indicators = IndicatorSet()
+
+        for n, col in enumerate(range(start_col, end_col + 1)):
+            date = dates[n]
+            dt = sim_datetime(date)
+
+            for a, account_id in enumerate(result.account_ids):
+                account = accounts[account_id]
+                account.dt = dt
+                self.update_account(account, col)
+
+                # the stocks of a closed market are left out up front, the account value is still recorded
+                trading_specs = [spec for spec in account_specs[account_id]
+                                 if trading_calendar.is_trading_day(date, spec.symbol)]
+
+                trade_failed = False
+                for spec in trading_specs:
+                    stock = account.get_stock(spec.symbol)
+                    if not stock:
+                        stock = self.new_stock(account, spec.symbol, col)
+                    if stock is None:
+                        continue
+
+                    stock.budget = account.net_value * spec.share
+                    stock.in_algorithm = spec.in_algorithm
+                    stock.in_stance = spec.in_stance
+                    stock.out_algorithm = spec.out_algorithm
+                    stock.out_stance = spec.out_stance
+                    stock.history = market.window(spec.symbol, col, MIN_HISTORY_DAYS)
+                    stock.indicators = indicators
+
+                    if stock.count:
+                        if stock.out_algorithm >= len(out_algorithms):
+                            continue
+                        alg = out_algorithms[stock.out_algorithm]
+                    else:
+                        if stock.in_algorithm >= len(in_algorithms):
+                            continue
+                        alg = in_algorithms[stock.in_algorithm]
+
+                    with tracing.span(self.trace, 'trade_decision', account=account_id, symbol=spec.symbol,
+                                      algorithm=alg.__class__.__name__):
+                        decision = alg.trade_decision(stock)
+
+                    if not stock.float_trade:
+                        decision = int(decision)
+
+                    if decision != 0:
+                        stock.last_count = stock.count
+                        if not stock.market_order(decision, 0):
+                            trade_failed = True
+
+                        order = self.make_order(stock, dt, decision, trade_failed)
+                        if order.action == models.ACTION_BUY:
+                            stock.entry_price = order.price
+                        result.orders.append(order)
+
+                self.update_account(account, col)
+                result.net_values[a, n] = account.net_value
+                result.cash_to_trade[a, n] = account.cash_to_trade
+
+            if progress is not None:
+                progress(n + 1, len(dates), str(date))
+
+        return result
+
+    def update_account(self, account, col):
+        account.net_value = account.cash_to_trade
+        for stock in account.stock_list:
+            value = self.market.get_quote(stock.symbol, col)
+            if value is None:
+                continue
+            stock.value = value
+            account.net_value += stock.value * stock.count
+
+    def new_stock(self, account, symbol, col):
+        value = self.market.get_quote(symbol, col)
+        if value is None:
+            return None
+
+        stock = simstocks.Stock(symbol, account)
+        stock.value = value
+        stock.count = 0
+        stock.entry_price = None
+        account.stock_list.append(stock)
+
+        return stock
+
+    @staticmethod
+    def make_order(stock, dt, decision, failed):
+        if decision > 0 and not failed:
+            action = models.ACTION_BUY
+        elif decision > 0:
+            action = models.ACTION_BUY_FAIL
+        elif decision < 0 and not failed:
+            action = models.ACTION_SELL
+        else:
+            action = models.ACTION_SELL_FAIL
+
+        return BacktestOrder(dt, stock.account.id, stock.symbol, abs(decision), stock.value, action,
+                             stock.get_failure_reason())
+
+
+def load_market(specs, start_date, end_date):
+    symbols = [spec.symbol for spec in specs]
+    return MarketData.load(symbols, start_date - timezone.timedelta(LOOKBACK_DAYS), end_date)
+
+
+def get_date_range(start_date=None, end_date=None):
+    histories = models.SimHistory.objects.all()
+    if start_date is not None:
+        histories = histories.filter(date__gte=start_date)
+    if end_date is not None:
+        histories = histories.filter(date__lte=end_date)
+
+    first = histories.order_by('date').values_list('date', flat=True).first()
+    last = histories.order_by('-date').values_list('date', flat=True).first()
+    if first is None or last is None:
+        return None, None
+
+    return first, last
+
+
+def backtest(start_date=None, end_date=None, specs=None, progress=None, trace=None, overrides=None):
+    start_date, end_date = get_date_range(start_date, end_date)
+    if start_date is None:
+        return None, None
+
+    if specs is None:
+        specs = load_specs(overrides)
+
+    with tracing.span(trace, 'load_market'):
+        market = load_market(specs, start_date, end_date)
+
+    logger.info('running backtest: %s - %s, %d stocks' % (str(start_date), str(end_date), len(specs)))
+
+    with tracing.span(trace, 'backtest'):
+        result = Backtest(market, specs, start_date, end_date, trace=trace).run(progress)
+
+    return result, market
+
+
+@transaction.atomic
+def store_result(result):
+    # everything is keyed by a new SimulationRun, the live Order/DayReport/Quote/DayHistory rows stay untouched
+    run = models.SimulationRun()
+    run.start_date = result.dates[0]
+    run.end_date = result.dates[-1]
+    run.save()
+
+    reasons = dict()
+    for message in set(order.failure_reason for order in result.orders):
+        reasons[message], _ = models.FailureReason.objects.get_or_create(message=message)
+
+    orders = []
+    for order in result.orders:
+        orders.append(models.SimOrder(run=run, dt=order.dt, account_id=order.account_id, symbol=order.symbol,
+                                      count=order.count, price=order.price, action=order.action,
+                                      failure_reason=reasons[order.failure_reason]))
+    models.SimOrder.objects.bulk_create(orders, batch_size=500)
+
+    reports = []
+    for a, account_id in enumerate(result.account_ids):
+        for n, date in enumerate(result.dates):
+            reports.append(models.SimDayReport(run=run, date=date, account_id=account_id,
+                                               net_value=float(result.net_values[a, n]),
+                                               cash_to_trade=float(result.cash_to_trade[a, n])))
+    models.SimDayReport.objects.bulk_create(reports, batch_size=500)
+
+    run.finished = True
+    run.save()
+
+    return run
+
+
+def delete_old_runs(keep=None):
+    if keep is None:
+        keep = getattr(settings, 'SIM_RUNS_TO_KEEP', SIM_RUNS_TO_KEEP)
+
+    old_ids = list(models.SimulationRun.objects.order_by('-id').values_list('id', flat=True)[keep:])
+    if old_ids:
+        models.SimulationRun.objects.filter(id__in=old_ids).delete()
+
+
+def get_combinations(in_algorithms=None, in_stances=None, out_algorithms=None, out_stances=None):
+    # None means every choice of the field
+    stances = [choice[0] for choice in models.STANCE_CHOICE]
+    if in_algorithms is None:
+        in_algorithms = range(len(in_algorithm_list))
+    if in_stances is None:
+        in_stances = stances
+    if out_algorithms is None:
+        out_algorithms = range(len(out_algorithm_list))
+    if out_stances is None:
+        out_stances = stances
+
+    return list(itertools.product(in_algorithms, in_stances, out_algorithms, out_stances))
+
+
+class SweepResult:
+    def __init__(self, combination, net_value, drawdown, trade_count):
+        self.in_algorithm, self.in_stance, self.out_algorithm, self.out_stance = combination
+        self.net_value = net_value
+        self.drawdown = drawdown
+        self.trade_count = trade_count
+
+    @property
+    def in_algorithm_name(self):
+        return in_algorithm_list[self.in_algorithm].name
+
+    @property
+    def in_stance_name(self):
+        return dict(models.STANCE_CHOICE)[self.in_stance]
+
+    @property
+    def out_algorithm_name(self):
+        return out_algorithm_list[self.out_algorithm].name
+
+    @property
+    def out_stance_name(self):
+        return dict(models.STANCE_CHOICE)[self.out_stance]
+
+    def __str__(self):
+        return '%s/%s %s/%s: net %f drawdown %.3f trades %d' % (self.in_algorithm_name, self.in_stance_name,
+                                                             self.out_algorithm_name, self.out_stance_name,
+                                                             self.net_value, self.drawdown, self.trade_count)
+
+
+_sweep_state = dict()
+
+
+def _init_sweep_worker(market, specs, start_date, end_date):
+    if not apps.ready:
+        import django
+        django.setup()
+
+    _sweep_state['market'] = market
+    _sweep_state['specs'] = specs
+    _sweep_state['start_date'] = start_date
+    _sweep_state['end_date'] = end_date
+
+
+def _run_combination(combination):
+    in_algorithm, in_stance, out_algorithm, out_stance = combination
+    specs = [spec.override(in_algorithm, in_stance, out_algorithm, out_stance) for spec in _sweep_state['specs']]
+
+    result = Backtest(_sweep_state['market'], specs, _sweep_state['start_date'], _sweep_state['end_date']).run()
+    net_values = result.total_net_values()
+    net_value = float(net_values[-1]) if len(net_values) else 0.0
+
+    return SweepResult(combination, net_value, result.max_drawdown(), result.trade_count())
+
+
+def sweep(start_date=None, end_date=None, combinations=None, processes=None, progress=None):
+    # runs every combination on its own in-memory state, the Stock rows are only read for symbols and shares
+    start_date, end_date = get_date_range(start_date, end_date)
+    if start_date is None:
+        return []
+
+    if combinations is None:
+        combinations = get_combinations()
+
+    specs = load_specs()
+    market = load_market(specs, start_date, end_date)
+
+    logger.info('sweeping %d combinations: %s - %s' % (len(combinations), str(start_date), str(end_date)))
+
+    # the workers never touch the database, don't let them inherit the connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_sweep_worker,
+                             initargs=(market, specs, start_date, end_date)) as executor:
+        results = []
+        for result in executor.map(_run_combination, combinations, chunksize=4):
+            results.append(result)
+            if progress is not None:
+                progress(len(results), len(combinations), str(result))
+
+    results.sort(key=lambda r: r.net_value, reverse=True)
+
+    return results
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import os
+import json
+import math
+import random
+import zlib
+import logging
+import platform
+import subprocess
+import numpy as np
+from contextlib import contextmanager
+import python_simtrade.accounts as simaccounts
+from . import models
+from . import main
+from . import backtest
+from . import metrics
+from . import tracing
+from . import history_writer
+from . import trading_calendar
+from .algorithms import in_algorithm_list, out_algorithm_list, MODERATE
+from .datasource import DataSource
+from .indicators import IndicatorSet
+from .marketdata import prefetch_history_windows, MIN_HISTORY_DAYS
+from .reports import get_report_list
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+logger = logging.getLogger('benchmark')
+
+RESULT_VERSION = 1
+
+# the synthetic history ends here, the years of a case go back from it
+END_DATE = timezone.datetime(year=2019, month=12, day=31).date()
+SYMBOL_FORMAT = 'SYN%03d'
+FIRST_ACCOUNT_ID = 900000
+STOCKS_PER_ACCOUNT = 10
+DEFAULT_SEED = 1
+DEFAULT_SYMBOLS = (5, 20)
+DEFAULT_YEARS = (1, 5)
+
+# yearly drift and volatility of the symbols are drawn from these ranges
+DRIFT_RANGE = (-0.1, 0.2)
+VOLATILITY_RANGE = (0.15, 0.6)
+TRADING_DAYS_PER_YEAR = 252
+
+
+def generate_bars(symbol, start_date, end_date, seed=DEFAULT_SEED):
+    # geometric brownian bars of start_date <= date < end_date on the trading days of the symbol,
+    # the most recent one first like DataSource.fetch(). the same arguments always give the same bars
+    rng = np.random.default_rng([seed, zlib.crc32(symbol.encode())])
+    drift = rng.uniform(*DRIFT_RANGE)
+    volatility = rng.uniform(*VOLATILITY_RANGE)
+    price = rng.uniform(10.0, 500.0)
+
+    dates = []
+    date = start_date
+    while date < end_date:
+        if trading_calendar.is_trading_day(date, symbol):
+            dates.append(date)
+        date += timezone.timedelta(1)
+    if not dates:
+        return []
+
+    n = len(dates)
+    dt = 1.0 / TRADING_DAYS_PER_YEAR
+    steps = (drift - volatility ** 2 / 2) * dt + volatility * math.sqrt(dt) * rng.standard_normal(n)
+    closes = price * np.exp(np.cumsum(steps))
+    opens = np.concatenate(([price], closes[:-1])) * np.exp(0.1 * volatility * math.sqrt(dt) * rng.standard_normal(n))
+    spread = np.abs(volatility * math.sqrt(dt) * rng.standard_normal((2, n)))
+    highs = np.maximum(opens, closes) * np.exp(spread[0])
+    lows = np.minimum(opens, closes) * np.exp(-spread[1])
+    volumes = np.round(rng.lognormal(13.0, 0.5, n))
+
+    bars = [(dates[i], float(opens[i]), float(highs[i]), float(lows[i]), float(closes[i]), float(volumes[i]))
+            for i in range(n)]
+    bars.reverse()
+
+    return bars
+
+
+class SyntheticDataSource(DataSource):
+    def __init__(self, seed=DEFAULT_SEED):
+        self.seed = seed
+
+    def fetch(self, symbol, start_date, end_date):
+        return generate_bars(symbol, start_date, end_date, self.seed)
+
+
+def create_stocks(n_symbols):
+    # replaces the accounts and stocks with synthetic ones, STOCKS_PER_ACCOUNT stocks per account.
+    # the algorithms go round so that every one of them trades
+    models.Account.objects.all().delete()
+
+    specs = []
+    for n in range(n_symbols):
+        account_id = FIRST_ACCOUNT_ID + n // STOCKS_PER_ACCOUNT
+        if n % STOCKS_PER_ACCOUNT == 0:
+            db_account = models.Account.objects.create(account_type=models.ACCOUNT_ETRADE, account_id=account_id)
+        n_stocks = min(STOCKS_PER_ACCOUNT, n_symbols - (n - n % STOCKS_PER_ACCOUNT))
+        db_stock = models.Stock.objects.create(account=db_account, symbol=SYMBOL_FORMAT % n, share=1.0 / n_stocks,
+                                               in_algorithm=n % len(in_algorithm_list), in_stance=MODERATE,
+                                               out_algorithm=n % len(out_algorithm_list), out_stance=MODERATE)
+        specs.append(backtest.StockSpec.from_db(db_stock))
+
+    return specs
+
+
+def time_algorithm(market, specs, algorithm_class, start_date, end_date, holding):
+    # trade_decision() of one algorithm for every stock and trading day of the range,
+    # with no position (holding False) or a full one
+    engine = backtest.Backtest(market, specs, start_date, end_date)
+    algorithm = algorithm_class()
+    indicators = IndicatorSet()
+    account = simaccounts.Account(FIRST_ACCOUNT_ID, None)
+    account.cash_to_trade = engine.initial_cash
+    account.net_value = engine.initial_cash
+
+    count = 0
+    for col in range(max(market.col(start_date), 0), min(market.col(end_date), market.n_days - 1) + 1):
+        date = market.date(col)
+        for spec in specs:
+            if not trading_calendar.is_trading_day(date, spec.symbol):
+                continue
+            account.stock_list = []
+            stock = engine.new_stock(account, spec.symbol, col)
+            if stock is None:
+                continue
+            stock.budget = account.net_value * spec.share
+            stock.in_stance = MODERATE
+            stock.out_stance = MODERATE
+            stock.last_count = 0.0
+            stock.history = market.window(spec.symbol, col, MIN_HISTORY_DAYS)
+            stock.indicators = indicators
+            if holding:
+                stock.count = stock.budget / stock.value
+                stock.entry_price = stock.value
+            algorithm.trade_decision(stock)
+            count += 1
+
+    return count
+
+
+@contextmanager
+def scratch_database():
+    # a new empty database in place of the configured one for the block, the test database of Django
+    # (in memory on sqlite). the cases replace every Account and SimHistory row, never run them on the live one
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def run_case(n_symbols, n_years, seed=DEFAULT_SEED):
+    # one size of the suite in a transaction that is rolled back, the database is left as it was.
+    # the case deletes the accounts and histories first, so it belongs in a scratch_database()
+    random.seed(seed)
+    trace = tracing.Trace('benchmark')
+    end_date = END_DATE
+    start_date = end_date - timezone.timedelta(365 * n_years)
+    history_start = start_date - timezone.timedelta(backtest.LOOKBACK_DAYS)
+    case = {'symbols': n_symbols, 'years': n_years}
+
+    # the rolled back bars and runs never reached the database, so they don't reach the metrics either
+    with metrics.discarding(), transaction.atomic():
+        models.SimHistory.objects.all().delete()
+        specs = create_stocks(n_symbols)
+        symbols = [spec.symbol for spec in specs]
+
+        with trace.span('fetch_symbols'):
+            fetched = main.fetch_symbols(SyntheticDataSource(seed), symbols, history_start,
+                                         end_date + timezone.timedelta(1))
+        with trace.span('write_histories'):
+            case['bars'] = history_writer.write_histories(models.SimHistory, fetched)
+
+        with trace.span('load_market'):
+            market = backtest.load_market(specs, start_date, end_date)
+        with trace.span('backtest'):
+            result = backtest.Backtest(market, specs, start_date, end_date).run()
+        with trace.span('store_result'):
+            run = backtest.store_result(result)
+        with trace.span('report_list'):
+            legends, report_list = get_report_list(start_date, end_date, run)
+        case['orders'] = len(result.orders)
+        case['report_lines'] = len(report_list)
+
+        with trace.span('load_history_sim'):
+            main.load_history_sim(end_date)
+        with trace.span('prefetch_histories'):
+            prefetch_history_windows(symbols, MIN_HISTORY_DAYS, end_date)
+
+        decisions = dict()
+        for holding, algorithm_list in ((False, in_algorithm_list), (True, out_algorithm_list)):
+            for algorithm_class in algorithm_list:
+                name = '%s:%s' % ('out' if holding else 'in', algorithm_class.__name__)
+                with trace.span(name):
+                    decisions[name] = time_algorithm(market, specs, algorithm_class, start_date, end_date, holding)
+
+        transaction.set_rollback(True)
+
+    case['timings'] = dict()
+    for span in trace.get_span_list():
+        timing = {'seconds': span['seconds'], 'queries': span['queries']}
+        if span['name'] in decisions:
+            timing['calls'] = decisions[span['name']]
+        case['timings'][span['name']] = timing
+
+    return case
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(symbol_sizes=DEFAULT_SYMBOLS, year_sizes=DEFAULT_YEARS, seed=DEFAULT_SEED, progress=None):
+    suite = {'version': RESULT_VERSION,
+             'created': timezone.now().isoformat(),
+             'commit': get_commit(),
+             'python': platform.python_version(),
+             'seed': seed,
+             'cases': []}
+
+    sizes = [(n_symbols, n_years) for n_symbols in symbol_sizes for n_years in year_sizes]
+    for done, (n_symbols, n_years) in enumerate(sizes, 1):
+        logger.info('benchmark: %d symbols, %d years' % (n_symbols, n_years))
+        suite['cases'].append(run_case(n_symbols, n_years, seed))
+        if progress is not None:
+            progress(done, len(sizes), '%d symbols %d years' % (n_symbols, n_years))
+
+    return suite
+
+
+def compare(suite, base):
+    # (symbols, years, step, seconds, base seconds) of the cases both results have
+    base_cases = {(case['symbols'], case['years']): case for case in base.get('cases', [])}
+
+    rows = []
+    for case in suite['cases']:
+        base_case = base_cases.get((case['symbols'], case['years']))
+        if base_case is None:
+            continue
+        for name, timing in case['timings'].items():
+            base_timing = base_case['timings'].get(name)
+            if base_timing is None:
+                continue
+            rows.append((case['symbols'], case['years'], name, timing['seconds'], base_timing['seconds']))
+
+    return rows
+
+
+def save(suite, path):
+    with open(path, 'w') as f:
+        json.dump(suite, f, indent=1)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import os
+import logging
+from . import models
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+
+logger = logging.getLogger('cache')
+
+REPORT_CACHE = 'reports'
+
+_missing = object()
+
+
+class LRUFileCache(FileBasedCache):
+    # FileBasedCache shared by the server processes. a read touches the file, so culling removes
+    # the least recently used entries until both MAX_ENTRIES and MAX_SIZE (bytes, 0 for no limit) hold
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._max_size = int(params.get('OPTIONS', {}).get('MAX_SIZE', 0))
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            return default
+
+        try:
+            os.utime(self._key_to_file(key, version))
+        except OSError:
+            pass
+
+        return value
+
+    def _cull(self):
+        entries = []
+        for fname in self._list_cache_files():
+            try:
+                stat = os.stat(fname)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fname))
+
+        entries.sort()
+        count = len(entries)
+        size = sum(entry[1] for entry in entries)
+        # leaves room for the entry being written
+        while entries and (count >= self._max_entries or (self._max_size and size > self._max_size)):
+            _, file_size, fname = entries.pop(0)
+            self._delete(fname)
+            count -= 1
+            size -= file_size
+
+
+def get_cache():
+    if REPORT_CACHE in getattr(settings, 'CACHES', {}):
+        return caches[REPORT_CACHE]
+
+    return caches['default']
+
+
+def get_data_version():
+    version = models.DataVersion.objects.filter(id=1).values_list('version', flat=True).first()
+
+    return version or 0
+
+
+def bump_data_version():
+    # every cached report and figure of an older version is left to the LRU eviction
+    if not models.DataVersion.objects.filter(id=1).update(version=F('version') + 1):
+        models.DataVersion.objects.get_or_create(id=1, defaults={'version': 1})
+
+
+def get_key(kind, start_date, end_date, run=None, version=None):
+    if version is None:
+        version = get_data_version()
+
+    return '%s:%s:%s:%s:%d' % (kind, start_date.isoformat(), end_date.isoformat(),
+                               'live' if run is None else 'run%d' % run.id, version)
+
+
+def lookup(key):
+    # the cached value, None when there is none
+    return get_cache().get(key)
+
+
+def get_or_set(key, compute):
+    cache = get_cache()
+    value = cache.get(key, _missing)
+    if value is _missing:
+        value = compute()
+        cache.set(key, value, None)
+    else:
+        logger.debug('cache hit: %s' % key)
+
+    return value
+
+
+@receiver(post_save, sender=models.Stock)
+@receiver(post_delete, sender=models.Stock)
+@receiver(post_save, sender=models.Account)
+@receiver(post_delete, sender=models.Account)
+def on_report_columns_changed(sender, **kwargs):
+    # the accounts and symbols are the columns of the reports
+    bump_data_version()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import logging
+import os
+import threading
+import numpy as np
+from os.path import join, exists, getmtime
+from django.conf import settings
+from . import models
+
+
+logger = logging.getLogger('columnar')
+
+# one structured .npy file per symbol in MARKET_DATA_DIR, sorted by date.
+# np.load(mmap_mode='r') maps them, so the pages are shared by every process through the page cache
+BAR_DTYPE = np.dtype([
+    ('date', 'datetime64[D]'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'f8'),
+])
+
+_maps = dict()
+_maps_lock = threading.Lock()
+
+
+def get_data_dir():
+    return getattr(settings, 'MARKET_DATA_DIR', None)
+
+
+def enabled():
+    return bool(get_data_dir())
+
+
+def get_path(symbol):
+    return join(get_data_dir(), '%s.npy' % symbol.replace(os.sep, '_'))
+
+
+def remove_symbol(symbol):
+    path = get_path(symbol)
+    if exists(path):
+        os.remove(path)
+        logger.info('%s: removed %s' % (symbol, path))
+    with _maps_lock:
+        _maps.pop(path, None)
+
+
+def build_symbol(symbol):
+    rows = list(models.SimHistory.objects.filter(symbol=symbol).order_by('date')
+                .values_list('date', 'open', 'high', 'low', 'close', 'volume'))
+    if not rows:
+        remove_symbol(symbol)
+        return
+
+    bars = np.array(rows, dtype=BAR_DTYPE)
+
+    path = get_path(symbol)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, bars)
+    # readers keep mapping the old file until they see the new mtime
+    os.replace(tmp_path, path)
+
+    logger.info('%s: %d bars stored in %s' % (symbol, len(bars), path))
+
+
+def sync(symbols=None):
+    if not enabled():
+        return
+
+    os.makedirs(get_data_dir(), exist_ok=True)
+    if symbols is None:
+        symbols = list(models.SimHistory.objects.order_by('symbol').values_list('symbol', flat=True).distinct())
+        # files of the symbols gone from SimHistory would still be served by open_symbol
+        stored = set(get_path(symbol) for symbol in symbols)
+        for filename in list_symbols():
+            if get_path(filename) not in stored:
+                remove_symbol(filename)
+
+    for symbol in symbols:
+        build_symbol(symbol)
+
+
+def open_symbol(symbol):
+    # the mapped bars of the symbol or None when the store has no file for it
+    if not enabled():
+        return None
+
+    path = get_path(symbol)
+    if not exists(path):
+        return None
+
+    mtime = getmtime(path)
+    with _maps_lock:
+        cached = _maps.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        bars = np.load(path, mmap_mode='r')
+        _maps[path] = (mtime, bars)
+
+    return bars
+
+
+def list_symbols():
+    if not enabled() or not exists(get_data_dir()):
+        return []
+
+    symbols = []
+    for filename in sorted(os.listdir(get_data_dir())):
+        if filename.endswith('.npy'):
+            symbols.append(filename[:-len('.npy')])
+
+    return symbols
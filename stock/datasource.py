@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import csv
+import io
+import logging
+import ssl
+import urllib.request
+from os.path import join, exists
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger('datasource')
+
+COIN_URL = 'https://www.cryptodatadownload.com/cdd/Coinbase_BTCUSD_d.csv'
+
+
+class DataSource:
+    # fetch() returns the daily bars of start_date <= date < end_date as
+    # (date, open, high, low, close, volume) tuples, the most recent one first
+    def fetch(self, symbol, start_date, end_date):
+        return []
+
+
+class YahooDataSource(DataSource):
+    def fetch(self, symbol, start_date, end_date):
+        import yfinance as yf
+
+        # a Ticker of its own, yf.download() keeps module level state and fetch() runs on several threads.
+        # not adjusted, like yf.download() gave
+        data = yf.Ticker(symbol).history(
+            start='%4.4d-%2.2d-%2.2d' % (start_date.year, start_date.month, start_date.day),
+            end='%4.4d-%2.2d-%2.2d' % (end_date.year, end_date.month, end_date.day),
+            auto_adjust=False)
+
+        data.sort_index(axis=0, ascending=False, inplace=True)
+
+        bars = []
+        for index, row in data.iterrows():
+            bars.append((index.date(), float(row['Open']), float(row['High']), float(row['Low']),
+                         float(row['Close']), float(row['Volume'])))
+
+        return bars
+
+
+class CoinDataSource(DataSource):
+    def fetch(self, symbol, start_date, end_date):
+        ssl._create_default_https_context = ssl._create_unverified_context
+
+        page = urllib.request.urlopen(COIN_URL)
+        reader = csv.reader(io.TextIOWrapper(page))
+
+        bars = []
+        for row in reader:
+            if 'Created' in row[0]:
+                continue
+            if 'Date' in row[0]:
+                continue
+
+            d_digit = row[0].split(' ')[0].split('-')
+            date = timezone.datetime(year=int(d_digit[0]), month=int(d_digit[1]), day=int(d_digit[2])).date()
+            if not start_date <= date < end_date:
+                continue
+
+            bars.append((date, float(row[2]), float(row[3]), float(row[4]), float(row[5]), float(row[6])))
+
+        bars.sort(key=lambda bar: bar[0], reverse=True)
+
+        return bars
+
+
+class CSVDataSource(DataSource):
+    # <HISTORY_CSV_DIR>/<symbol>.csv with a Date,Open,High,Low,Close,Volume header, dates as YYYY-MM-DD
+    def __init__(self, path=None):
+        if path is None:
+            path = getattr(settings, 'HISTORY_CSV_DIR', 'history_csv')
+        self.path = path
+
+    def fetch(self, symbol, start_date, end_date):
+        filename = join(self.path, '%s.csv' % symbol)
+        if not exists(filename):
+            logger.error('no history file: %s' % filename)
+            return []
+
+        bars = []
+        with open(filename) as f:
+            for row in csv.DictReader(f):
+                date = timezone.datetime.strptime(row['Date'], '%Y-%m-%d').date()
+                if not start_date <= date < end_date:
+                    continue
+                bars.append((date, float(row['Open']), float(row['High']), float(row['Low']),
+                             float(row['Close']), float(row['Volume'])))
+
+        bars.sort(key=lambda bar: bar[0], reverse=True)
+
+        return bars
+
+
+class DefaultDataSource(DataSource):
+    # yahoo finance for stocks, cryptodatadownload for BTC
+    def __init__(self):
+        self.stock_source = YahooDataSource()
+        self.coin_source = CoinDataSource()
+
+    def fetch(self, symbol, start_date, end_date):
+        if symbol == 'BTC':
+            return self.coin_source.fetch(symbol, start_date, end_date)
+
+        return self.stock_source.fetch(symbol, start_date, end_date)
+
+
+def get_data_source():
+    source_class = getattr(settings, 'HISTORY_DATA_SOURCE', 'stock.datasource.DefaultDataSource')
+
+    return import_string(source_class)()
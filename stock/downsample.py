@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    # largest triangle three buckets: indices of threshold points that keep the shape of the line.
+    # the first and the last points always stay, x must be ascending
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bucket_size = (n - 2) / (threshold - 2)
+
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if end >= next_end:
+            avg_x, avg_y = x[-1], y[-1]
+        else:
+            avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+
+        # the point of the bucket with the largest triangle between the last selected one and the next average
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def downsample(y, threshold):
+    # (index, value) of the points kept from a daily series, None or '' for days without a value
+    valid = [n for n, value in enumerate(y) if value is not None and value != '']
+    if not valid:
+        return []
+
+    x = np.array(valid, dtype=np.float64)
+    values = np.array([y[n] for n in valid], dtype=np.float64)
+
+    return [(valid[n], float(values[n])) for n in lttb(x, values, threshold)]
@@ -59,6 +59,7 @@ class SimulateForm(forms.ModelForm):
 
     start_date = forms.DateField(initial=timezone.now().today()-td, widget=forms.SelectDateWidget(years=year_choices))
     end_date = forms.DateField(initial=timezone.now().today(), widget=forms.SelectDateWidget(years=year_choices))
+    sweep = forms.BooleanField(required=False, label='Sweep (empty fields take every choice)')
 
 
 class GraphRangeForm(forms.Form):
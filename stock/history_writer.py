@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import logging
+from . import performance
+from . import metrics
+
+
+logger = logging.getLogger('history_writer')
+
+BATCH_SIZE = 1000
+
+
+def write_histories(model, symbol_bars, batch_size=BATCH_SIZE):
+    # symbol_bars: {symbol: [(date, open, high, low, close, volume), ...]} for DayHistory or SimHistory.
+    # the dates already stored are read in one query over the whole date range, the rest is bulk inserted
+    symbol_bars = {symbol: bars for symbol, bars in symbol_bars.items() if bars}
+    if not symbol_bars:
+        return 0
+
+    first_date = min(bar[0] for bars in symbol_bars.values() for bar in bars)
+    last_date = max(bar[0] for bars in symbol_bars.values() for bar in bars)
+
+    existing = set(model.objects.filter(symbol__in=symbol_bars.keys(), date__gte=first_date, date__lte=last_date)
+                   .values_list('symbol', 'date'))
+
+    histories = []
+    first_dates = dict()
+    for symbol, bars in symbol_bars.items():
+        for date, open, high, low, close, volume in bars:
+            if (symbol, date) in existing:
+                continue
+            existing.add((symbol, date))
+            if symbol not in first_dates or date < first_dates[symbol]:
+                first_dates[symbol] = date
+            histories.append(model(symbol=symbol, date=date, open=open, high=high, low=low, close=close,
+                                   volume=volume))
+
+    # another writer may still get in between, let the database skip those rows
+    model.objects.bulk_create(histories, batch_size=batch_size, ignore_conflicts=True)
+    logger.debug('%s: %d bars written' % (model.__name__, len(histories)))
+    metrics.HISTORY_ROWS.inc(len(histories), model=model.__name__)
+
+    # the performance series move from the first new bar of each symbol
+    performance.update_histories(model, first_dates)
+
+    return len(histories)
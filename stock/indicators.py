@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import json
+import logging
+import threading
+import numpy as np
+from collections import deque
+from . import models
+
+
+logger = logging.getLogger('indicators')
+
+indicator_dict = dict()
+
+
+class Indicator:
+    # state over the daily bars of one symbol, fed one bar at a time from the oldest one
+    kind = None
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.last_date = None
+
+    def reset(self):
+        self.count = 0
+        self.last_date = None
+
+    def ready(self):
+        return self.count >= self.period
+
+    def push(self, history, i):
+        self.count += 1
+
+    def advance(self, history):
+        # pushes the bars of the window (the most recent first) newer than the state.
+        # returns True when the state changed
+        dates = history.dates
+        if not len(dates):
+            return False
+        if self.last_date is not None and dates[0] == self.last_date:
+            return False
+
+        n = 0
+        if self.last_date is not None:
+            while n < len(dates) and dates[n] > self.last_date:
+                n += 1
+
+        if self.last_date is None or n == len(dates) or dates[n] != self.last_date:
+            # first use, a gap or history that went back in time: rebuild from the window
+            self.reset()
+            n = len(dates)
+
+        for i in range(n - 1, -1, -1):
+            self.push(history, i)
+        self.last_date = dates[0]
+
+        return True
+
+    def get_state(self):
+        return {'count': self.count}
+
+    def set_state(self, state):
+        self.count = state['count']
+
+
+class RollingRange(Indicator):
+    # period high and low with monotonic deques of (bar number, value)
+    kind = 'range'
+
+    def __init__(self, period):
+        super().__init__(period)
+        self.highs = deque()
+        self.lows = deque()
+
+    def reset(self):
+        super().reset()
+        self.highs.clear()
+        self.lows.clear()
+
+    def push(self, history, i):
+        n = self.count
+        high = float(history.high[i])
+        low = float(history.low[i])
+
+        while self.highs and self.highs[-1][1] <= high:
+            self.highs.pop()
+        self.highs.append((n, high))
+        while self.highs[0][0] <= n - self.period:
+            self.highs.popleft()
+
+        while self.lows and self.lows[-1][1] >= low:
+            self.lows.pop()
+        self.lows.append((n, low))
+        while self.lows[0][0] <= n - self.period:
+            self.lows.popleft()
+
+        self.count += 1
+
+    def high(self):
+        return self.highs[0][1]
+
+    def low(self):
+        return self.lows[0][1]
+
+    def get_state(self):
+        state = super().get_state()
+        state['highs'] = list(self.highs)
+        state['lows'] = list(self.lows)
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.highs = deque(tuple(v) for v in state['highs'])
+        self.lows = deque(tuple(v) for v in state['lows'])
+
+
+indicator_dict[RollingRange.kind] = RollingRange
+
+
+class WeightedMomentum(Indicator):
+    # the weighted open to open differences of VertexAlgorithm:
+    #   sum(d[i] * (1 - (i + 1) / period)) for the latest period - 2 differences, d[0] the most recent
+    # kept as diff_sum = sum(d[i]) and index_sum = sum((i + 1) * d[i])
+    kind = 'vertex'
+
+    def __init__(self, period):
+        super().__init__(period)
+        self.diffs = deque()
+        self.latest_open = None
+        self.diff_sum = 0.0
+        self.index_sum = 0.0
+
+    def reset(self):
+        super().reset()
+        self.diffs.clear()
+        self.latest_open = None
+        self.diff_sum = 0.0
+        self.index_sum = 0.0
+
+    def push(self, history, i):
+        open = float(history.open[i])
+        if self.latest_open is not None:
+            diff = open - self.latest_open
+            n = self.period - 2
+            dropped = 0.0
+            self.diffs.appendleft(diff)
+            if len(self.diffs) > n:
+                dropped = self.diffs.pop()
+            # every difference moves one index further, the dropped one leaves at index n
+            self.index_sum = diff + self.index_sum + self.diff_sum - (n + 1) * dropped
+            self.diff_sum = self.diff_sum + diff - dropped
+        self.latest_open = open
+        self.count += 1
+
+    def rate(self, value):
+        return (value - self.latest_open) + self.diff_sum - self.index_sum / self.period
+
+    def get_state(self):
+        state = super().get_state()
+        state['diffs'] = list(self.diffs)
+        state['latest_open'] = self.latest_open
+        state['diff_sum'] = self.diff_sum
+        state['index_sum'] = self.index_sum
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.diffs = deque(state['diffs'])
+        self.latest_open = state['latest_open']
+        self.diff_sum = state['diff_sum']
+        self.index_sum = state['index_sum']
+
+
+indicator_dict[WeightedMomentum.kind] = WeightedMomentum
+
+
+class IndicatorSet:
+    # indicators of a run keyed by (kind, symbol, period), optionally persisted in IndicatorState.
+    # the accounts of a run may share a symbol from several threads
+    def __init__(self):
+        self.indicators = dict()
+        self.changed = set()
+        self.lock = threading.Lock()
+
+    def get(self, indicator_class, symbol, period, history):
+        key = (indicator_class.kind, symbol, period)
+        with self.lock:
+            indicator = self.indicators.get(key)
+            if indicator is None:
+                indicator = indicator_class(period)
+                self.indicators[key] = indicator
+
+            if indicator.advance(history):
+                self.changed.add(key)
+
+        return indicator
+
+    @classmethod
+    def load(cls):
+        indicator_set = cls()
+        for db_state in models.IndicatorState.objects.all():
+            indicator_class = indicator_dict.get(db_state.kind)
+            if indicator_class is None:
+                continue
+            indicator = indicator_class(db_state.period)
+            try:
+                indicator.set_state(json.loads(db_state.state))
+            except (ValueError, KeyError):
+                logger.error('broken indicator state: %s' % str(db_state))
+                continue
+            if db_state.last_date is not None:
+                indicator.last_date = np.datetime64(db_state.last_date, 'D')
+            indicator_set.indicators[(db_state.kind, db_state.symbol, db_state.period)] = indicator
+
+        return indicator_set
+
+    def save(self):
+        if not self.changed:
+            return
+
+        db_states = dict()
+        for db_state in models.IndicatorState.objects.all():
+            db_states[(db_state.kind, db_state.symbol, db_state.period)] = db_state
+
+        new_states = []
+        changed_states = []
+        for key in self.changed:
+            indicator = self.indicators[key]
+            db_state = db_states.get(key)
+            if db_state is None:
+                db_state = models.IndicatorState(kind=key[0], symbol=key[1], period=key[2])
+                new_states.append(db_state)
+            else:
+                changed_states.append(db_state)
+            db_state.last_date = indicator.last_date.item() if indicator.last_date is not None else None
+            db_state.state = json.dumps(indicator.get_state())
+
+        models.IndicatorState.objects.bulk_create(new_states)
+        models.IndicatorState.objects.bulk_update(changed_states, ['last_date', 'state'])
+        self.changed = set()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import json
+import time
+import datetime
+import logging
+import threading
+from . import models
+from . import main
+from . import backtest
+from . import querybudget
+from django.conf import settings
+from django.db import close_old_connections, connection, DatabaseError
+from django.db.models import Case, When
+from django.utils import timezone
+
+
+logger = logging.getLogger('jobs')
+
+JOB_RUN = 'run'
+JOB_SIMULATE = 'simulate'
+JOB_SWEEP = 'sweep'
+JOB_LOAD_HISTORY = 'load_history'
+
+POLL_INTERVAL = 2.0
+PROGRESS_INTERVAL = 0.5
+# a running job touches its heartbeat this often, a job without one for JOB_STALE_SECONDS is taken as dead
+HEARTBEAT_INTERVAL = 10.0
+JOB_STALE_SECONDS = 120
+
+job_dict = dict()
+
+
+class JobError(Exception):
+    pass
+
+
+def job_handler(kind):
+    def register(handler):
+        job_dict[kind] = handler
+        return handler
+    return register
+
+
+class Progress:
+    # progress callback of a running job. the row is written at most every PROGRESS_INTERVAL seconds
+    def __init__(self, job):
+        self.job_id = job.id
+        self.last_time = 0.0
+
+    def __call__(self, done, total, message=''):
+        now = time.monotonic()
+        if done < total and now - self.last_time < PROGRESS_INTERVAL:
+            return
+        self.last_time = now
+
+        models.Job.objects.filter(id=self.job_id).update(progress=done, total=total, message=message[:300])
+
+
+class Heartbeat(threading.Thread):
+    # keeps the heartbeat of a running job fresh while the handler works, on its own database connection
+    def __init__(self, job_id):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(HEARTBEAT_INTERVAL):
+                try:
+                    models.Job.objects.filter(id=self.job_id, status=models.JOB_RUNNING)\
+                        .update(heartbeat=timezone.now())
+                except DatabaseError:
+                    logger.exception('job heartbeat failed: %d' % self.job_id)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def parse_date(value):
+    if value is None:
+        return None
+    return timezone.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+@job_handler(JOB_RUN)
+def run_job(progress):
+    main.load_history(simulate=False, progress=progress)
+    result = main.run()
+    if not result:
+        raise JobError('run failed: %s' % ', '.join(str(account) for account in result.accounts))
+
+    return result.to_dict()
+
+
+@job_handler(JOB_SIMULATE)
+def simulate_job(progress, start_date=None, end_date=None, in_algorithm=None, in_stance=None, out_algorithm=None,
+                 out_stance=None):
+    # the choices come with the job, the Stock rows of the live accounts are never changed for a simulation
+    overrides = {'in_algorithm': in_algorithm, 'in_stance': in_stance,
+                 'out_algorithm': out_algorithm, 'out_stance': out_stance}
+    run = main.simulate(parse_date(start_date), parse_date(end_date), progress=progress, overrides=overrides)
+
+    return {'run': run.id if run is not None else None}
+
+
+@job_handler(JOB_SWEEP)
+def sweep_job(progress, start_date=None, end_date=None, combinations=None):
+    if combinations is not None:
+        combinations = [tuple(combination) for combination in combinations]
+    results = backtest.sweep(parse_date(start_date), parse_date(end_date), combinations, progress=progress)
+
+    return {'sweep': [{'combination': [result.in_algorithm, result.in_stance,
+                                       result.out_algorithm, result.out_stance],
+                       'net_value': result.net_value,
+                       'drawdown': result.drawdown,
+                       'trade_count': result.trade_count} for result in results]}
+
+
+@job_handler(JOB_LOAD_HISTORY)
+def load_history_job(progress, simulate=False):
+    main.load_history(simulate=simulate, progress=progress)
+
+    return dict()
+
+
+def enqueue(kind, **params):
+    # a job of the same kind and parameters that is still queued is returned instead of a new one
+    if kind not in job_dict:
+        raise JobError('unknown job: %s' % kind)
+
+    params = json.dumps(params, sort_keys=True)
+    job = models.Job.objects.filter(kind=kind, params=params, status=models.JOB_QUEUED).first()
+    if job is None:
+        job = models.Job.objects.create(kind=kind, params=params)
+        logger.info('job queued: %s' % str(job))
+
+    return job
+
+
+def get_result(job):
+    if not job.result:
+        return None
+    return json.loads(job.result)
+
+
+def get_status(job):
+    return {'id': job.id,
+            'kind': job.kind,
+            'status': dict(models.JOB_STATUS_CHOICE)[job.status],
+            'progress': job.progress,
+            'total': job.total,
+            'message': job.message,
+            'result': get_result(job)}
+
+
+def claim_next(kinds=None):
+    # the oldest queued job of kinds (any if None), marked running. the runs trading live go before the others.
+    # the conditional update keeps two workers from taking the same job
+    queued = models.Job.objects.filter(status=models.JOB_QUEUED)
+    if kinds is not None:
+        queued = queued.filter(kind__in=kinds)
+    for job in queued.order_by(Case(When(kind=JOB_RUN, then=0), default=1), 'id')[0:5]:
+        started = timezone.now()
+        if models.Job.objects.filter(id=job.id, status=models.JOB_QUEUED)\
+                .update(status=models.JOB_RUNNING, started=started, heartbeat=started):
+            job.status = models.JOB_RUNNING
+            job.started = started
+            job.heartbeat = started
+            return job
+
+    return None
+
+
+def finish(job, **fields):
+    # the final status, only while the job is still ours. a job recovered meanwhile stays failed
+    if models.Job.objects.filter(id=job.id, status=models.JOB_RUNNING).update(finished=timezone.now(), **fields):
+        return True
+
+    logger.warning('job %d was no longer running, its result is dropped' % job.id)
+    return False
+
+
+def execute(job):
+    handler = job_dict.get(job.kind)
+    heartbeat = Heartbeat(job.id)
+    heartbeat.start()
+    try:
+        if handler is None:
+            raise JobError('unknown job: %s' % job.kind)
+        with querybudget.profile('job %d %s' % (job.id, job.kind)):
+            result = handler(Progress(job), **json.loads(job.params))
+    except Exception as e:
+        logger.exception('job failed: %s' % str(job))
+        finish(job, status=models.JOB_FAILED, message=str(e)[:300])
+        return False
+    finally:
+        heartbeat.stop()
+
+    if not finish(job, status=models.JOB_DONE, result=json.dumps(result)):
+        return False
+    logger.info('job done: %d %s' % (job.id, job.kind))
+
+    return True
+
+
+def recover():
+    # jobs whose worker died can't be resumed. a job is dead once its heartbeat is older than JOB_STALE_SECONDS
+    stale = timezone.now() - datetime.timedelta(seconds=getattr(settings, 'JOB_STALE_SECONDS', JOB_STALE_SECONDS))
+    return models.Job.objects.filter(status=models.JOB_RUNNING, heartbeat__lt=stale)\
+        .update(status=models.JOB_FAILED, finished=timezone.now(), message='worker stopped')
+
+
+def work(once=False, poll_interval=POLL_INTERVAL, kinds=None):
+    # runs the queued jobs of kinds one at a time. one worker takes every kind and a second one (run_jobs --live)
+    # only the runs, so a long simulation never holds up trading. see the run_jobs command
+    while True:
+        close_old_connections()
+        recover()
+        job = claim_next(kinds)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        logger.info('job started: %s' % str(job))
+        execute(job)
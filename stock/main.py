@@ -16,36 +16,53 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
 
 import logging
-import csv
-import io
-import urllib
-import holidays
+import threading
 import python_etrade.client as etclient
-import python_simtrade.client as simclient
 import python_coinbase.client as coinbase_client
-import yfinance as yf
-import ssl
 
 from . import models
+from . import datasource
+from . import history_writer
+from . import columnar
+from . import backtest
+from . import marketdata
+from .marketdata import MIN_HISTORY_DAYS
+from .indicators import IndicatorSet
+from . import orderids
+from . import performance
+from . import cache
+from . import trading_calendar
+from . import unitofwork
+from . import tracing
+from . import metrics
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, connection
 from .algorithms import in_algorithm_list, out_algorithm_list
 from django.conf import settings
 from fake_useragent import UserAgent
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 logger = logging.getLogger('main_loop')
-MIN_HISTORY_DAYS = 120
+HISTORY_FETCH_WORKERS = 8
+RUN_ACCOUNT_WORKERS = 4
+QUOTE_FETCH_WORKERS = 8
+QUOTE_BATCH_SIZE = 25
+
+ACCOUNT_PENDING = 'pending'
+ACCOUNT_DONE = 'done'
+ACCOUNT_LOGIN_FAILED = 'login_failed'
+ACCOUNT_NOT_FOUND = 'not_found'
+ACCOUNT_ERROR = 'error'
 
 
 def load_db_account(db_account, account):
     pass
 
 
-def store_db_account(db_account, account):
+def update_db_account(db_account, account):
     db_account.net_value = account.net_value
     db_account.cash_to_trade = account.cash_to_trade
-    db_account.save()
 
 
 def load_db_stock(db_stock, stock):
@@ -60,42 +77,21 @@ def load_db_stock(db_stock, stock):
         stock.last_count = 0.0
 
 
-def store_db_stock(db_stock, stock):
+def update_db_stock(db_stock, stock):
     db_stock.value = stock.value
     db_stock.count = stock.count
     db_stock.last_count = stock.last_count
-    db_stock.save()
-
-
-def store_day_report(db_account, dt):
-    prev_reports = models.DayReport.objects.filter(account=db_account, date=dt.date())
-    for prev_report in prev_reports:
-        prev_report.delete()
-
-    day_report = models.DayReport()
-    day_report.date = dt
-    day_report.account = db_account
-    day_report.net_value = db_account.net_value
-    day_report.cash_to_trade = db_account.cash_to_trade
-    day_report.save()
-
 
-def store_order(stock, dt, decision, failed, failure_reason):
-    reasons = models.FailureReason.objects.filter(message=failure_reason)
-    if not reasons:
-        reason = models.FailureReason()
-        reason.message = failure_reason
-        reason.save()
-    else:
-        reason = reasons[0]
 
+def make_order(stock, dt, decision, failed):
+    # the order row of a decision, written later by the UnitOfWork of the run
     order = models.Order()
     order.dt = dt
     order.symbol = stock.symbol
     order.account_id = stock.account.id
     order.count = abs(decision)
     order.price = stock.value
-    order.failure_reason = reason
+    order.failure_reason_id = stock.get_failure_reason()
     if decision > 0 and not failed:
         order.action = models.ACTION_BUY
     elif decision > 0:
@@ -104,53 +100,57 @@ def store_order(stock, dt, decision, failed, failure_reason):
         order.action = models.ACTION_SELL
     else:
         order.action = models.ACTION_SELL_FAIL
-    order.save()
-
 
-def store_quotes(client, dt):
-    symbol_list = []
-    for stock in models.Stock.objects.all():
-        if str(stock.symbol) not in symbol_list:
-            symbol_list.append(str(stock.symbol))
+    return order
 
-    for symbol in symbol_list:
-        quote = client.get_quote(symbol)
-        if not quote:
-            continue
-        prev_quotes = models.Quote.objects.filter(symbol=symbol, dt=dt).order_by('-dt')
-        for prev_quote in prev_quotes:
-            prev_quote.delete()
-
-        db_quote = models.Quote()
-        db_quote.dt = dt
-        db_quote.symbol = symbol
-        db_quote.ask = quote.ask
-        db_quote.bid = quote.bid
-        db_quote.save()
 
+def get_quote(client, symbol):
+    try:
+        return client.get_quote(symbol)
+    except Exception:
+        logger.exception('getting quote failed: %s' % symbol)
+        return None
+
+
+def fetch_quotes(client, symbol_list):
+    # {symbol: quote}. a client with get_quotes(symbols) is asked QUOTE_BATCH_SIZE symbols at a time,
+    # otherwise the single symbol requests go out concurrently
+    quotes = dict()
+    if not symbol_list:
+        return quotes
+
+    if hasattr(client, 'get_quotes'):
+        for n in range(0, len(symbol_list), QUOTE_BATCH_SIZE):
+            batch = symbol_list[n:n + QUOTE_BATCH_SIZE]
+            try:
+                batch_quotes = client.get_quotes(batch)
+            except Exception:
+                logger.exception('getting quotes failed: %s' % ', '.join(batch))
+                continue
+            for symbol, quote in batch_quotes.items():
+                if quote:
+                    quotes[symbol] = quote
+        return quotes
 
-def get_order_id():
-    order_ids = models.OrderID.objects.all()
-    if not order_ids:
-        order_id_obj = models.OrderID()
-        order_id_obj.order_id = 500
-        order_id_obj.save()
-        order_ids = models.OrderID.objects.all()
+    workers = getattr(settings, 'QUOTE_FETCH_WORKERS', QUOTE_FETCH_WORKERS)
+    with ThreadPoolExecutor(max_workers=min(workers, len(symbol_list))) as executor:
+        for symbol, quote in zip(symbol_list, executor.map(lambda symbol: get_quote(client, symbol), symbol_list)):
+            if quote:
+                quotes[symbol] = quote
 
-    order_id_obj = order_ids[0]
-    order_id = order_id_obj.order_id
+    return quotes
 
-    return order_id
 
+def write_quotes(dt, quotes):
+    db_quotes = dict()
+    for symbol, quote in quotes.items():
+        db_quotes[symbol] = models.Quote(symbol=symbol, dt=dt, ask=quote.ask, bid=quote.bid)
 
-def store_order_id(order_id):
-    try:
-        order_id_obj = models.OrderID.objects.all()[0]
-    except IndexError:
-        order_id_obj = models.OrderID()
+    with transaction.atomic():
+        models.Quote.objects.filter(symbol__in=db_quotes.keys(), dt=dt).delete()
+        models.Quote.objects.bulk_create(db_quotes.values())
 
-    order_id_obj.order_id = order_id
-    order_id_obj.save()
+    return db_quotes
 
 
 def get_in_algorithm(num):
@@ -171,313 +171,430 @@ def get_out_algorithm(num):
     return None
 
 
-@transaction.atomic
-def run(dt=None, client=None):
-    if dt is None:
-        dt = timezone.localtime()
+def get_history_period(db_stocks):
+    period = 0
+    for db_stock in db_stocks:
+        if db_stock.in_algorithm < len(in_algorithm_list):
+            period = max(period, in_algorithm_list[db_stock.in_algorithm].history_period)
+        if db_stock.out_algorithm < len(out_algorithm_list):
+            period = max(period, out_algorithm_list[db_stock.out_algorithm].history_period)
 
-    first = True
-    need_logout = False
-    orig_client = client
-    order_id = 0
+    return period
 
-    for db_account in models.Account.objects.all():
-        if not orig_client:
-            if client:
-                client.logout()
 
-            if db_account.account_type == models.ACCOUNT_ETRADE:
-                client = etclient.Client()
-                result = client.login(
-                    getattr(settings, 'ETRADE_KEY', ''),
-                    getattr(settings, 'ETRADE_SECRET', ''),
-                    getattr(settings, 'ETRADE_USERNAME', ''),
-                    getattr(settings, 'ETRADE_PASSWORD', ''))
-            elif db_account.account_type == models.ACCOUNT_COINBASE:
-                client = coinbase_client.Client()
-                result = client.login(
-                    getattr(settings, 'COINBASE_KEY', ''),
-                    getattr(settings, 'COINBASE_SECRET', '')
-                    )
-
-            if first:
-                store_quotes(client, dt)
-                order_id = get_order_id()
-                first = False
-
-            if not result:
-                logger.error('login failed')
+def prefetch_histories(dt):
+    db_stocks = list(models.Stock.objects.all())
+    symbols = [str(db_stock.symbol) for db_stock in db_stocks]
+
+    return marketdata.prefetch_history_windows(symbols, get_history_period(db_stocks), dt.date())
+
+
+def set_stock_history(stock, histories):
+    # the broker stock objects may live over several runs (sim client), never leave an old window behind
+    history = histories.get(stock.symbol)
+    if history is not None:
+        stock.history = history
+    elif hasattr(stock, 'history'):
+        del stock.history
+
+
+class AccountResult:
+    # outcome of one account in run()
+    def __init__(self, account_id):
+        self.account_id = account_id
+        self.status = ACCOUNT_PENDING
+        self.orders = 0
+        self.failed_orders = 0
+        self.net_value = None
+        self.error = ''
+
+    def to_dict(self):
+        return {'account_id': self.account_id,
+                'status': self.status,
+                'orders': self.orders,
+                'failed_orders': self.failed_orders,
+                'net_value': self.net_value,
+                'error': self.error}
+
+    def __str__(self):
+        return '%d: %s orders %d failed %d %s' % (self.account_id, self.status, self.orders, self.failed_orders,
+                                                  self.error)
+
+
+class RunResult:
+    # per account outcomes. false when a login failed or an account raised, like the old return value of run()
+    def __init__(self):
+        self.accounts = []
+
+    def __bool__(self):
+        for result in self.accounts:
+            if result.status in (ACCOUNT_LOGIN_FAILED, ACCOUNT_ERROR):
                 return False
-            logger.debug('logged in')
-            need_logout = True
+        return True
+
+    def to_dict(self):
+        return {'accounts': [result.to_dict() for result in self.accounts]}
+
+
+class RunState:
+    # what the accounts of one run() share: the order ids, the quote snapshot, histories, indicators and the trace.
+    # every account commits its own records, see run_account
+    def __init__(self, dt, histories, indicators, trace=None, order_ids=None):
+        self.dt = dt
+        self.histories = histories
+        self.indicators = indicators
+        self.trace = trace
+        # guards quotes, quoted_types and quote_events, and keeps the Quote writes and the account commits apart
+        # (sqlite fails a write transaction that meets another one instead of waiting)
+        self.lock = threading.Lock()
+        self.order_ids = order_ids if order_ids is not None else orderids.OrderIdAllocator()
+        self.quotes = dict()
+        self.quoted_types = set()
+        # {account type: event set when the client taking its snapshot is done}
+        self.quote_events = dict()
+
+    def store_quotes(self, client, account_type):
+        # the first logged in client of each broker takes the snapshot of the symbols traded there,
+        # the other accounts of the broker wait for it. the quotes are fetched outside the lock,
+        # so the brokers don't wait on each other's network
+        while True:
+            with self.lock:
+                if account_type in self.quoted_types:
+                    return
+                event = self.quote_events.get(account_type)
+                if event is None:
+                    event = self.quote_events[account_type] = threading.Event()
+                    break
+            # when the snapshot failed the next account takes it over
+            event.wait()
 
-        account = client.get_account(db_account.account_id)
-        if account is None:
-            logger.error('getting account failed: wrong account_id?')
-            continue
+        try:
+            symbol_list = models.Stock.objects.filter(account__account_type=account_type)\
+                .order_by('symbol').values_list('symbol', flat=True).distinct()
+            quotes = fetch_quotes(client, [str(symbol) for symbol in symbol_list])
+            with self.lock:
+                self.quotes.update(write_quotes(self.dt, quotes))
+                self.quoted_types.add(account_type)
+        finally:
+            with self.lock:
+                del self.quote_events[account_type]
+            event.set()
+
+    def get_quote_value(self, symbol):
+        # the snapshot value like python_simtrade: the middle of ask and bid
+        quote = self.quotes.get(symbol)
+        if quote is None:
+            return None
+        return (quote.ask + quote.bid) / 2
+
+    def next_order_id(self):
+        return self.order_ids.next()
+
+
+def login_client(account_type):
+    if account_type == models.ACCOUNT_ETRADE:
+        client = etclient.Client()
+        result = client.login(
+            getattr(settings, 'ETRADE_KEY', ''),
+            getattr(settings, 'ETRADE_SECRET', ''),
+            getattr(settings, 'ETRADE_USERNAME', ''),
+            getattr(settings, 'ETRADE_PASSWORD', ''))
+    elif account_type == models.ACCOUNT_COINBASE:
+        client = coinbase_client.Client()
+        result = client.login(
+            getattr(settings, 'COINBASE_KEY', ''),
+            getattr(settings, 'COINBASE_SECRET', '')
+            )
+    else:
+        return None
 
-        load_db_account(db_account, account)
+    if not result:
+        return None
 
-        logger.debug('account id:%d mode: %s' % (account.id, account.mode))
+    return client
 
-        trade_failed = False
-        for db_stock in models.Stock.objects.filter(account=db_account):
 
-            us_holidays = holidays.UnitedStates()
-            if dt.date() in us_holidays and db_stock.symbol != 'BTC':
-                logger.info('skipping sim: US holiday')
-                continue
+def run_account(db_account, client, state):
+    # trades one account. the database writes are buffered until the broker work is done and then
+    # committed for this account alone, so a slow broker never holds the database and a failing
+    # commit of another account doesn't lose the records of this one
+    dt = state.dt
+    trace = state.trace
+    result = AccountResult(db_account.account_id)
 
-            stock = account.get_stock(db_stock.symbol)
-            if not stock:
-                stock = account.new_stock(db_stock.symbol)
-            if stock is None:
-                logger.error('new stock is None %s' % db_stock.symbol)
-                continue
+    with tracing.span(trace, 'get_account', account=db_account.account_id):
+        account = client.get_account(db_account.account_id)
+    if account is None:
+        logger.error('getting account failed: wrong account_id?')
+        result.status = ACCOUNT_NOT_FOUND
+        return result
 
-            load_db_stock(db_stock, stock)
+    load_db_account(db_account, account)
 
-            if stock.count:
-                alg = get_out_algorithm(stock.out_algorithm)
-                if not alg:
-                    continue
-            else:
-                alg = get_in_algorithm(stock.in_algorithm)
-                if not alg:
-                    continue
+    logger.debug('account id:%d mode: %s' % (account.id, account.mode))
+
+    orders = []
+    db_stocks = []
+    trade_failed = False
+    for db_stock in models.Stock.objects.filter(account=db_account):
+        if not trading_calendar.is_trading_day(dt.date(), db_stock.symbol):
+            logger.info('skipping %s: market closed' % db_stock.symbol)
+            continue
+
+        stock = account.get_stock(db_stock.symbol)
+        if not stock:
+            stock = account.new_stock(db_stock.symbol)
+        if stock is None:
+            logger.error('new stock is None %s' % db_stock.symbol)
+            continue
+
+        load_db_stock(db_stock, stock)
+        set_stock_history(stock, state.histories)
+        value = state.get_quote_value(stock.symbol)
+        if value is not None:
+            stock.value = value
+        stock.indicators = state.indicators
+
+        if stock.count:
+            alg = get_out_algorithm(stock.out_algorithm)
+            if not alg:
+                continue
+        else:
+            alg = get_in_algorithm(stock.in_algorithm)
+            if not alg:
+                continue
 
-            logger.debug('run algorithm: %s' % alg.__class__.name)
+        logger.debug('run algorithm: %s' % alg.__class__.name)
+        with tracing.span(trace, 'trade_decision', account=account.id, symbol=stock.symbol,
+                          algorithm=alg.__class__.__name__), \
+                metrics.DECISION_SECONDS.time(algorithm=alg.__class__.__name__):
             decision = alg.trade_decision(stock)
 
-            if not stock.float_trade:
-                decision = int(decision)
+        if not stock.float_trade:
+            decision = int(decision)
 
-            logger.info('%s: decision=%f' % (stock.symbol, decision))
+        logger.info('%s: decision=%f' % (stock.symbol, decision))
 
-            if decision != 0:
-                stock.last_count = stock.count
+        if decision != 0:
+            stock.last_count = stock.count
 
-                if decision > 0:
-                    if not stock.market_order(decision, order_id):
-                        trade_failed = True
-                elif decision < 0:
-                    if not stock.market_order(decision, order_id):
-                        trade_failed = True
+            with tracing.span(trace, 'market_order', account=account.id, symbol=stock.symbol):
+                if not stock.market_order(decision, state.next_order_id()):
+                    trade_failed = True
 
-                order_id += 1
-                store_order(stock, dt, decision, trade_failed, stock.get_failure_reason())
+            orders.append(make_order(stock, dt, decision, trade_failed))
 
-            store_db_stock(db_stock, stock)
+        update_db_stock(db_stock, stock)
+        db_stocks.append(db_stock)
 
-        if not trade_failed and account.mode == 'setup':
-            account.mode = 'run'
+    if not trade_failed and account.mode == 'setup':
+        account.mode = 'run'
+    with tracing.span(trace, 'account_update', account=account.id):
         account.update()
-        store_db_account(db_account, account)
-        store_day_report(db_account, dt)
 
-    store_order_id(order_id)
+    update_db_account(db_account, account)
+    writer = unitofwork.UnitOfWork()
+    writer.add_account(db_account, dt, orders, db_stocks)
+    with tracing.span(trace, 'commit', account=account.id), state.lock:
+        writer.commit()
 
-    if need_logout:
-        client.logout()
-        logger.debug('logged out')
+    result.status = ACCOUNT_DONE
+    result.orders = len(orders)
+    result.failed_orders = len([order for order in orders
+                                if order.action in (models.ACTION_BUY_FAIL, models.ACTION_SELL_FAIL)])
+    result.net_value = db_account.net_value
 
-    return True
+    return result
 
 
-def simulate(start_date=None, end_date=None):
-    models.Order.objects.all().delete()
-    models.Quote.objects.all().delete()
-    models.DayReport.objects.all().delete()
-    models.DayHistory.objects.all().delete()
+def run_account_session(db_account, state):
+    # one account on its own broker session, in a worker thread with its own database connection
+    account_id = db_account.account_id
+    try:
+        with tracing.span(state.trace, 'login', account=account_id):
+            client = login_client(db_account.account_type)
+        if client is None:
+            logger.error('login failed')
+            result = AccountResult(db_account.account_id)
+            result.status = ACCOUNT_LOGIN_FAILED
+            return result
+        logger.debug('logged in')
 
-    for db_account in models.Account.objects.all():
-        db_account.save()
+        try:
+            with tracing.span(state.trace, 'store_quotes', account=account_id):
+                state.store_quotes(client, db_account.account_type)
+            with tracing.span(state.trace, 'account', account=account_id):
+                return run_account(db_account, client, state)
+        finally:
+            with tracing.span(state.trace, 'logout', account=account_id):
+                client.logout()
+            logger.debug('logged out')
+    except Exception as e:
+        logger.exception('account %d failed' % db_account.account_id)
+        result = AccountResult(db_account.account_id)
+        result.status = ACCOUNT_ERROR
+        result.error = str(e)
+        return result
+    finally:
+        connection.close()
+
+
+def run(dt=None, client=None, order_ids=None):
+    # with a client (the simulation) the accounts share it and go one by one,
+    # otherwise every account logs in on its own and the accounts run concurrently.
+    # order_ids is an OrderIdAllocator kept across runs, a new one otherwise
+    if dt is None:
+        dt = timezone.localtime()
 
-        for db_stock in models.Stock.objects.filter(account=db_account):
-            db_stock.count = 0
-            db_stock.save()
+    mode = 'live' if client is None else 'stepwise'
+    with tracing.Trace(tracing.TRACE_RUN) as trace, metrics.RUN_SECONDS.time(mode=mode):
+        with trace.span('prefetch_histories'):
+            histories = prefetch_histories(dt)
+        with trace.span('load_indicators'):
+            indicators = IndicatorSet.load()
+        state = RunState(dt, histories, indicators, trace, order_ids)
+        db_accounts = list(models.Account.objects.all())
+        run_result = RunResult()
 
-    if start_date is None:
-        first_quote = models.SimHistory.objects.all().order_by('date')[0]
-    else:
-        try:
-            first_quote = models.SimHistory.objects.filter(date__gte=start_date).order_by('date')[0]
-        except IndexError:
-            return False
+        if client is not None:
+            for db_account in db_accounts:
+                with trace.span('account', account=db_account.account_id):
+                    run_result.accounts.append(run_account(db_account, client, state))
+        elif db_accounts:
+            workers = getattr(settings, 'RUN_ACCOUNT_WORKERS', RUN_ACCOUNT_WORKERS)
+            with ThreadPoolExecutor(max_workers=min(workers, len(db_accounts))) as executor:
+                futures = [executor.submit(run_account_session, db_account, state) for db_account in db_accounts]
+                run_result.accounts = [future.result() for future in futures]
 
-    cur_dt = timezone.datetime(year=first_quote.date.year, month=first_quote.date.month, day=first_quote.date.day,
-                               hour=9, minute=31, second=0, tzinfo=timezone.get_default_timezone())
+        for result in run_result.accounts:
+            logger.info('run: %s' % str(result))
 
-    if end_date is None:
-        last_quote = models.SimHistory.objects.all().order_by('-date')[0]
-    else:
-        try:
-            last_quote = models.SimHistory.objects.filter(date__lte=end_date).order_by('-date')[0]
-        except IndexError:
-            return False
+        with trace.span('save_indicators'):
+            state.indicators.save()
+        cache.bump_data_version()
 
-    last_dt = timezone.datetime(year=last_quote.date.year, month=last_quote.date.month, day=last_quote.date.day,
-                                hour=23, minute=59, second=59, tzinfo=timezone.get_default_timezone())
+    metrics.flush()
 
-    day_delta = timezone.timedelta(1)
+    return run_result
 
-    simclient.reset_sim_config()
-    client = simclient.Client()
-    client.login(cur_dt)
-    while cur_dt <= last_dt:
-        logger.info('running sim: ' + str(cur_dt))
-        client.update(cur_dt)
-        run(dt=cur_dt, client=client)
-        load_history_sim(cur_dt.date())
-        cur_dt += day_delta
 
-    client.logout()
+def simulate(start_date=None, end_date=None, progress=None, overrides=None):
+    # overrides: the algorithm and stance choices to simulate in place of the stocks' own, see StockSpec.override
+    with tracing.Trace(tracing.TRACE_SIMULATE) as trace:
+        result, market = backtest.backtest(start_date, end_date, progress=progress, trace=trace,
+                                           overrides=overrides)
+        if result is None or not result.dates:
+            return None
 
-    return True
+        with trace.span('store_result'):
+            run = backtest.store_result(result)
+        with trace.span('delete_old_runs'):
+            backtest.delete_old_runs()
+        cache.bump_data_version()
+
+    return run
 
 
 def load_history_sim(cur_date):
-    symbol_list = []
+    # copies the latest MIN_HISTORY_DAYS bars of every symbol from SimHistory into DayHistory
+    start_date = cur_date - timezone.timedelta(days=2 * MIN_HISTORY_DAYS)
+    sim_histories = models.SimHistory.objects.filter(symbol__in=get_symbol_list(),
+                                                     date__gte=start_date, date__lte=cur_date)\
+        .order_by('symbol', '-date').values_list('symbol', 'date', 'open', 'high', 'low', 'close', 'volume')
 
-    for stock in models.Stock.objects.all():
-        if str(stock.symbol) not in symbol_list:
-            symbol_list.append(str(stock.symbol))
+    symbol_bars = dict()
+    for sim_history in sim_histories:
+        bars = symbol_bars.setdefault(sim_history[0], [])
+        if len(bars) < MIN_HISTORY_DAYS:
+            bars.append(sim_history[1:])
 
-    for symbol in symbol_list:
-        sim_histories = models.SimHistory.objects.filter(symbol=symbol, date__lte=cur_date).order_by('-date')[:MIN_HISTORY_DAYS]
-        if len(sim_histories) == 0:
-            continue
+    history_writer.write_histories(models.DayHistory, symbol_bars)
 
-        for sim_history in sim_histories:
-            prev_histories = models.DayHistory.objects.filter(symbol=symbol, date=sim_history.date)
-            if prev_histories:
-                break
-
-            day_history = models.DayHistory()
-            day_history.symbol = sim_history.symbol
-            day_history.date = sim_history.date
-            day_history.open = sim_history.open
-            day_history.high = sim_history.high
-            day_history.low = sim_history.low
-            day_history.close = sim_history.close
-            day_history.volume = sim_history.volume
-            day_history.save()
-
-def load_stock_symbol(symbol, today, simulate):
-    today_histories = models.DayHistory.objects.filter(symbol=symbol, date=today)
-    if today_histories:
-        return
 
+def get_symbol_list():
+    return list(models.Stock.objects.order_by('symbol').values_list('symbol', flat=True).distinct())
+
+
+def get_history_start_date(today, simulate):
     if not simulate:
-        td = timezone.timedelta(day=MIN_HISTORY_DAYS)
-        start_date = today - td
-    else:
-        start_date = timezone.datetime(year=2002, month=1, day=1)
+        return today - timezone.timedelta(days=MIN_HISTORY_DAYS)
 
-    data = yf.download(symbol,
-        start='%4.4d-%2.2d-%2.2d' % (start_date.year, start_date.month, start_date.day),
-        end='%4.4d-%2.2d-%2.2d' % (today.year, today.month, today.day))
+    return timezone.datetime(year=2002, month=1, day=1).date()
 
-    data.sort_index(axis=0, ascending=False, inplace=True)
 
-    for index, row in data.iterrows():
-        if not simulate:
-            t_histories = models.DayHistory.objects.filter(symbol=symbol, date=index.date())
-        else:
-            t_histories = models.SimHistory.objects.filter(symbol=symbol, date=index.date())
+def get_history_model(simulate):
+    if not simulate:
+        return models.DayHistory
 
-        if t_histories:
-            break
+    return models.SimHistory
 
-        if not simulate:
-            day_history = models.DayHistory()
-        else:
-            day_history = models.SimHistory()
-        day_history.symbol = symbol
-        day_history.date = index.date()
-        day_history.open = float(row[0])
-        day_history.high = float(row[1])
-        day_history.low = float(row[2])
-        day_history.close = float(row[3])
-        day_history.volume = int(row[4])
-        day_history.save()
 
-    return True
+def fetch_symbol(source, symbol, start_date, end_date, trace=None):
+    with tracing.span(trace, 'fetch', symbol=symbol):
+        return source.fetch(symbol, start_date, end_date)
 
 
-def load_coin_symbol(symbol, today, simulate):
-    today_histories = models.DayHistory.objects.filter(symbol=symbol, date=today)
-    if today_histories:
-        return
+def fetch_symbols(source, symbol_list, start_date, end_date, progress=None, trace=None):
+    # network only, the database is written by the caller thread. progress(done, total) after every symbol
+    workers = getattr(settings, 'HISTORY_FETCH_WORKERS', HISTORY_FETCH_WORKERS)
+    fetched = dict()
+    if not symbol_list:
+        return fetched
 
-    ssl._create_default_https_context = ssl._create_unverified_context
+    with ThreadPoolExecutor(max_workers=min(workers, len(symbol_list))) as executor:
+        futures = dict()
+        for symbol in symbol_list:
+            futures[executor.submit(fetch_symbol, source, symbol, start_date, end_date, trace)] = symbol
 
-    url = 'https://www.cryptodatadownload.com/cdd/Coinbase_BTCUSD_d.csv'
-    page = urllib.request.urlopen(url)
-    reader = csv.reader(io.TextIOWrapper(page))
+        for done, future in enumerate(as_completed(futures), 1):
+            symbol = futures[future]
+            try:
+                fetched[symbol] = future.result()
+            except Exception:
+                logger.exception('loading history failed: %s' % symbol)
 
-    count = 0
-    for row in reader:
-        if 'Created' in row[0]:
-            continue
-        if 'Date' in row[0]:
-            continue
+            if progress is not None:
+                progress(done, len(symbol_list), symbol)
 
-        d_digit = row[0].split('-')
-        t_dt = timezone.datetime(year=int(d_digit[0]), month=int(d_digit[1]), day=int(d_digit[2]))
+    return fetched
 
-        if timezone.localtime().date() == t_dt.date():
-            continue
 
-        if not simulate:
-            t_histories = models.DayHistory.objects.filter(symbol=symbol, date=t_dt.date())
-        else:
-            t_histories = models.SimHistory.objects.filter(symbol=symbol, date=t_dt.date())
-        if t_histories:
-            break
+def load_history(simulate=False, source=None, progress=None):
+    today = timezone.now().date()
 
-        if not simulate:
-            day_history = models.DayHistory()
-        else:
-            day_history = models.SimHistory()
-        day_history.symbol = symbol
-        day_history.date = t_dt.date()
-        day_history.open = float(row[2])
-        day_history.high = float(row[3])
-        day_history.low = float(row[4])
-        day_history.close = float(row[5])
-        day_history.volume = float(row[6])
-        day_history.save()
+    if source is None:
+        source = datasource.get_data_source()
 
-        count += 1
+    with tracing.Trace(tracing.TRACE_LOAD_HISTORY) as trace:
+        symbol_list = []
+        with trace.span('select_symbols'):
+            for symbol in get_symbol_list():
+                if not simulate and models.DayHistory.objects.filter(symbol=symbol, date=today).exists():
+                    continue
+                symbol_list.append(symbol)
 
-        if not simulate and (count >= MIN_HISTORY_DAYS):
-            break
+        with trace.span('fetch_symbols'):
+            fetched = fetch_symbols(source, symbol_list, get_history_start_date(today, simulate), today, progress,
+                                    trace)
 
-    return True
+        with trace.span('write_histories'), transaction.atomic():
+            if simulate:
+                # the symbols that failed keep their old bars, the rest (and the symbols no longer listed) go
+                failed = [symbol for symbol in symbol_list if symbol not in fetched]
+                if failed:
+                    logger.warning('old bars kept for the symbols that failed: %s' % ', '.join(failed))
+                models.SimHistory.objects.exclude(symbol__in=failed).delete()
+                performance.clear(models.SERIES_SIM_SYMBOL, failed)
 
-@transaction.atomic
-def load_history(simulate=False):
-    today = timezone.now().date()
-    symbol_list = []
+            count = history_writer.write_histories(get_history_model(simulate), fetched)
+            logger.info('%d bars loaded for %d symbols' % (count, len(fetched)))
 
-    if simulate:
-        models.SimHistory.objects.all().delete()
+            if simulate:
+                transaction.on_commit(lambda: columnar.sync())
 
-    for stock in models.Stock.objects.all():
-        if str(stock.symbol) not in symbol_list:
-            symbol_list.append(str(stock.symbol))
-    for symbol in symbol_list:
-        today_histories = models.DayHistory.objects.filter(symbol=symbol, date=today)
-        if today_histories:
-            continue
+        cache.bump_data_version()
 
-    ret = True
-    for symbol in symbol_list:
-        if symbol != 'BTC':
-            ret = load_stock_symbol(symbol, today, simulate)
-        else:
-            ret = load_coin_symbol(symbol, today, simulate)
+    metrics.flush()
 
     return True
 
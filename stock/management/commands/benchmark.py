@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+from django.core.management.base import BaseCommand, CommandError
+from stock import benchmark
+
+
+def parse_sizes(value):
+    try:
+        sizes = [int(size) for size in value.split(',') if size]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) <= 0:
+        raise CommandError('sizes are positive numbers separated by commas: %s' % value)
+    return sizes
+
+
+class Command(BaseCommand):
+    help = 'times the simulation, reports, history loaders and algorithms on synthetic history. ' \
+           'it runs in a new test database unless --live-database is given'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--symbols', default=','.join(str(n) for n in benchmark.DEFAULT_SYMBOLS),
+                            help='numbers of symbols, separated by commas')
+        parser.add_argument('--years', default=','.join(str(n) for n in benchmark.DEFAULT_YEARS),
+                            help='numbers of simulated years, separated by commas')
+        parser.add_argument('--seed', type=int, default=benchmark.DEFAULT_SEED, help='seed of the synthetic history')
+        parser.add_argument('--output', default='benchmark.json', help='json result file')
+        parser.add_argument('--compare', help='json result file of an earlier benchmark')
+        parser.add_argument('--live-database', action='store_true',
+                            help='run in the configured database. the cases replace all the accounts and histories '
+                                 'in a transaction that is rolled back, which holds the database while it runs')
+
+    def handle(self, *args, **options):
+        base = None
+        if options['compare']:
+            try:
+                base = benchmark.load(options['compare'])
+            except (OSError, ValueError) as e:
+                raise CommandError('reading %s failed: %s' % (options['compare'], e))
+
+        def progress(done, total, message):
+            self.stdout.write('%d/%d %s' % (done, total, message))
+
+        symbol_sizes = parse_sizes(options['symbols'])
+        year_sizes = parse_sizes(options['years'])
+        if options['live_database']:
+            suite = benchmark.run_suite(symbol_sizes, year_sizes, options['seed'], progress)
+        else:
+            with benchmark.scratch_database():
+                suite = benchmark.run_suite(symbol_sizes, year_sizes, options['seed'], progress)
+        benchmark.save(suite, options['output'])
+
+        for case in suite['cases']:
+            self.stdout.write('%d symbols, %d years, %d bars' % (case['symbols'], case['years'], case['bars']))
+            for name, timing in case['timings'].items():
+                self.stdout.write('  %-24s %10.4fs %6d queries' % (name, timing['seconds'], timing['queries']))
+
+        if base is not None:
+            self.stdout.write('compared with %s (%s)' % (options['compare'], base.get('commit')))
+            for n_symbols, n_years, name, seconds, base_seconds in benchmark.compare(suite, base):
+                ratio = seconds / base_seconds if base_seconds else float('inf')
+                self.stdout.write('  %3d symbols %2d years %-24s %10.4fs %10.4fs %6.2fx'
+                                  % (n_symbols, n_years, name, seconds, base_seconds, ratio))
+
+        self.stdout.write('written %s' % options['output'])
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+from django.core.management.base import BaseCommand
+from stock import cache
+from stock import performance
+
+
+class Command(BaseCommand):
+    help = 'rebuilds the performance series of the reports from the histories. the report pages only read them'
+
+    def handle(self, *args, **options):
+        count = performance.rebuild()
+        cache.bump_data_version()
+        self.stdout.write('%d performance rows' % count)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import os
+import fcntl
+import tempfile
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from stock import jobs
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'runs the queued run, simulate and load_history jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+        parser.add_argument('--poll', type=float, default=jobs.POLL_INTERVAL, help='seconds between queue checks')
+        parser.add_argument('--live', action='store_true', help='run only the live runs')
+
+    def handle(self, *args, **options):
+        # only one worker of each sort, a second one waits here until the first exits. the lock goes with the process
+        path = getattr(settings, 'JOB_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'myetrade_run_jobs.lock'))
+        kinds = None
+        if options['live']:
+            path = '%s.live' % path
+            kinds = [jobs.JOB_RUN]
+        with open(path, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info('waiting for the other job worker to exit')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            jobs.work(once=options['once'], poll_interval=options['poll'], kinds=kinds)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import logging
+import numpy as np
+from . import models
+from . import columnar
+from django.utils import timezone
+
+
+logger = logging.getLogger('marketdata')
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+# bars handed to the algorithms, by run() and by the backtest
+MIN_HISTORY_DAYS = 120
+
+
+class Bar:
+    def __init__(self, symbol, date, open, high, low, close, volume):
+        self.symbol = symbol
+        self.date = date
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __str__(self):
+        return '%2.2d/%2.2d/%4.4d - %s: open %f high %f low %f close %f volume %f' \
+               % (self.date.month, self.date.day, self.date.year, self.symbol,
+                  self.open, self.high, self.low, self.close, self.volume)
+
+
+class HistoryWindow:
+    # daily bars of one symbol, the most recent bar first (same order as DayHistory order_by('-date'))
+    def __init__(self, symbol, dates, open, high, low, close, volume):
+        self.symbol = symbol
+        self.dates = dates
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, i):
+        return Bar(self.symbol, self.dates[i].item(), float(self.open[i]), float(self.high[i]),
+                   float(self.low[i]), float(self.close[i]), float(self.volume[i]))
+
+    def latest(self, period):
+        if period >= len(self.dates):
+            return self
+        return HistoryWindow(self.symbol, self.dates[:period], self.open[:period], self.high[:period],
+                             self.low[:period], self.close[:period], self.volume[:period])
+
+    @classmethod
+    def from_rows(cls, symbol, rows):
+        # rows: (date, open, high, low, close, volume) ordered from the most recent one
+        if not rows:
+            empty = np.zeros(0)
+            return cls(symbol, np.zeros(0, dtype='datetime64[D]'), empty, empty, empty, empty, empty)
+
+        columns = list(zip(*rows))
+        dates = np.array(columns[0], dtype='datetime64[D]')
+        values = [np.array(column, dtype=np.float64) for column in columns[1:]]
+
+        return cls(symbol, dates, *values)
+
+
+def load_history_window(symbol, period):
+    rows = models.DayHistory.objects.filter(symbol=symbol).order_by('-date')\
+        .values_list('date', *FIELDS)[0:period]
+
+    return HistoryWindow.from_rows(symbol, list(rows))
+
+
+def prefetch_history_windows(symbols, period, today):
+    # the latest bars of every symbol in one query. the date bound leaves room for weekends and holidays,
+    # a symbol that still gets less than period bars is left out and read with load_history_window()
+    symbols = set(symbols)
+    if not symbols or period <= 0:
+        return dict()
+
+    start_date = today - timezone.timedelta(period * 2 + 10)
+    rows = models.DayHistory.objects.filter(symbol__in=symbols, date__gte=start_date).order_by('symbol', '-date')\
+        .values_list('symbol', 'date', *FIELDS)
+
+    symbol_rows = dict()
+    for row in rows:
+        symbol_rows.setdefault(row[0], []).append(row[1:])
+
+    windows = dict()
+    for symbol, rows in symbol_rows.items():
+        if len(rows) < period:
+            continue
+        windows[symbol] = HistoryWindow.from_rows(symbol, rows[:period])
+
+    return windows
+
+
+class MarketData:
+    # SimHistory bars as 2D arrays: one row per symbol, one column per calendar day (NaN when there is no bar)
+    def __init__(self, symbols, first_date, values):
+        self.symbols = list(symbols)
+        self.first_date = first_date
+        self.values = values
+        self.row_dict = {symbol: row for row, symbol in enumerate(self.symbols)}
+
+        n_cols = values['open'].shape[1]
+        self.n_days = n_cols
+        self.valid = ~np.isnan(values['open'])
+
+        # column of the last bar at or before each column, -1 when there is none yet
+        cols = np.where(self.valid, np.arange(n_cols), -1)
+        self.last_col = np.maximum.accumulate(cols, axis=1) if n_cols else cols
+
+        # quote of the day is the open of the last bar, like python_simtrade.stocks.Quote
+        self.quote = np.take_along_axis(values['open'], np.maximum(self.last_col, 0), axis=1)
+        self.quote[self.last_col < 0] = np.nan
+
+        # compact per symbol arrays and the number of bars before each column
+        self.bar_count = np.cumsum(self.valid, axis=1)
+        self.bars = []
+        for row in range(len(self.symbols)):
+            bar_cols = np.flatnonzero(self.valid[row])
+            dates = np.datetime64(first_date, 'D') + bar_cols
+            bar_values = [values[field][row, bar_cols] for field in FIELDS]
+            self.bars.append((dates[::-1], [value[::-1] for value in bar_values]))
+
+    def col(self, date):
+        return (date - self.first_date).days
+
+    def date(self, col):
+        return self.first_date + timezone.timedelta(int(col))
+
+    def get_quote(self, symbol, col):
+        row = self.row_dict.get(symbol)
+        if row is None:
+            return None
+        value = self.quote[row, col]
+        if np.isnan(value):
+            return None
+        return float(value)
+
+    def window(self, symbol, col, period):
+        # the bars strictly before the column, the most recent one first
+        row = self.row_dict[symbol]
+        dates, values = self.bars[row]
+        n_bars = len(dates)
+        before = self.bar_count[row, col - 1] if col > 0 else 0
+        start = n_bars - before
+        end = min(n_bars, start + period)
+
+        return HistoryWindow(symbol, dates[start:end], *[value[start:end] for value in values])
+
+    @classmethod
+    def load(cls, symbols, start_date, end_date):
+        symbols = sorted(set(symbols))
+
+        n_cols = (end_date - start_date).days + 1
+        if n_cols < 0:
+            n_cols = 0
+        values = dict()
+        for field in FIELDS:
+            values[field] = np.full((len(symbols), n_cols), np.nan)
+
+        if cls.load_columnar(symbols, start_date, end_date, values):
+            return cls(symbols, start_date, values)
+
+        rows = list(models.SimHistory.objects.filter(symbol__in=symbols, date__gte=start_date, date__lte=end_date)
+                    .values_list('symbol', 'date', *FIELDS))
+
+        row_dict = {symbol: row for row, symbol in enumerate(symbols)}
+        if rows:
+            columns = list(zip(*rows))
+            row_index = np.array([row_dict[symbol] for symbol in columns[0]], dtype=np.intp)
+            col_index = (np.array(columns[1], dtype='datetime64[D]') - np.datetime64(start_date, 'D')).astype(np.intp)
+            for n, field in enumerate(FIELDS):
+                values[field][row_index, col_index] = np.array(columns[n + 2], dtype=np.float64)
+
+        logger.debug('loaded %d bars for %d symbols', len(rows), len(symbols))
+
+        return cls(symbols, start_date, values)
+
+    @staticmethod
+    def load_columnar(symbols, start_date, end_date, values):
+        # fills the arrays from the memory-mapped store, False when a symbol is not in the store
+        symbol_bars = []
+        for symbol in symbols:
+            bars = columnar.open_symbol(symbol)
+            if bars is None:
+                return False
+            symbol_bars.append(bars)
+
+        start = np.datetime64(start_date, 'D')
+        end = np.datetime64(end_date, 'D')
+        for row, bars in enumerate(symbol_bars):
+            dates = bars['date']
+            first = np.searchsorted(dates, start)
+            last = np.searchsorted(dates, end, side='right')
+            cols = (dates[first:last] - start).astype(np.intp)
+            for field in FIELDS:
+                values[field][row, cols] = bars[field][first:last]
+
+        logger.debug('mapped %d symbols from the columnar store', len(symbols))
+
+        return True
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import os
+import json
+import time
+import atexit
+import logging
+import tempfile
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from django.conf import settings
+
+
+logger = logging.getLogger('metrics')
+
+# every process writes its values to <METRICS_DIR>/<pid>.json, the metrics page adds the files up
+METRICS_DIR = os.path.join(tempfile.gettempdir(), 'myetrade_metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RUN_BUCKETS = (1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+lock = threading.Lock()
+metric_dict = dict()
+# {metric name: {label values: value}}. a counter value is a float,
+# a histogram value is [count per bucket and one for +Inf, sum]
+values = dict()
+# the values as last written, discard() goes back to them
+flushed = dict()
+dirty = False
+loaded = False
+# flush() writes nothing while a discarding() block runs
+suspended = 0
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        metric_dict[name] = self
+        values[name] = dict()
+
+    def get_key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+
+class Counter(Metric):
+    kind = COUNTER
+
+    def inc(self, amount=1.0, **labels):
+        global dirty
+        key = self.get_key(labels)
+        with lock:
+            series = values[self.name]
+            series[key] = series.get(key, 0.0) + amount
+            dirty = True
+
+    def merge(self, value, other):
+        return value + other
+
+    def lines(self, series):
+        for key, value in sorted(series.items()):
+            yield '%s%s %s' % (self.name, format_labels(self.labels, key), format_value(value))
+
+
+class Histogram(Metric):
+    kind = HISTOGRAM
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount, **labels):
+        global dirty
+        key = self.get_key(labels)
+        n = 0
+        while n < len(self.buckets) and amount > self.buckets[n]:
+            n += 1
+        with lock:
+            series = values[self.name]
+            value = series.get(key)
+            if value is None:
+                value = series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            value[n] += 1
+            value[-1] += amount
+            dirty = True
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def merge(self, value, other):
+        if len(value) != len(other):
+            # written with other buckets, by an older version
+            return value
+        return [a + b for a, b in zip(value, other)]
+
+    def lines(self, series):
+        bounds = [format_value(bound) for bound in self.buckets] + ['+Inf']
+        for key, value in sorted(series.items()):
+            count = 0
+            for bound, bucket_count in zip(bounds, value[:-1]):
+                count += bucket_count
+                yield '%s_bucket%s %d' % (self.name, format_labels(self.labels + ('le',), key + (bound,)), count)
+            yield '%s_sum%s %s' % (self.name, format_labels(self.labels, key), format_value(value[-1]))
+            yield '%s_count%s %d' % (self.name, format_labels(self.labels, key), count)
+
+
+RUN_SECONDS = Histogram('stock_run_seconds', 'Duration of main.run() by mode (live, or stepwise with the sim client)',
+                        labels=('mode',), buckets=RUN_BUCKETS)
+DECISION_SECONDS = Histogram('stock_decision_seconds', 'Latency of trade_decision() by algorithm class',
+                             labels=('algorithm',))
+ORDERS = Counter('stock_orders_total', 'Orders stored by run() by result (placed or failed) and FailureReason',
+                 labels=('result', 'reason'))
+HISTORY_ROWS = Counter('stock_history_rows_total', 'Daily bars ingested by model', labels=('model',))
+REQUEST_SECONDS = Histogram('stock_request_seconds', 'Latency of the report and simulation pages by view',
+                            labels=('view',))
+
+
+def format_value(value):
+    return repr(float(value))
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, key):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in zip(names, key))
+
+
+def get_metrics_dir():
+    return getattr(settings, 'METRICS_DIR', METRICS_DIR)
+
+
+def get_path(pid=None):
+    return os.path.join(get_metrics_dir(), '%d.json' % (os.getpid() if pid is None else pid))
+
+
+def read_file(path):
+    # {metric name: {label values: value}} from one process file
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+    file_values = dict()
+    for name, entries in data.items():
+        metric = metric_dict.get(name)
+        if metric is not None:
+            # entries written with other labels, by an older version, are dropped
+            file_values[name] = {tuple(key): value for key, value in entries if len(key) == len(metric.labels)}
+    return file_values
+
+
+def copy_values(source):
+    return {name: {key: list(value) if isinstance(value, list) else value for key, value in series.items()}
+            for name, series in source.items()}
+
+
+def merge_into(target, file_values):
+    for name, series in file_values.items():
+        metric = metric_dict[name]
+        target_series = target.setdefault(name, dict())
+        for key, value in series.items():
+            if key in target_series:
+                target_series[key] = metric.merge(target_series[key], value)
+            else:
+                target_series[key] = value
+
+
+def flush():
+    # writes the values of this process when they changed. a file left by an earlier process with the same
+    # pid is taken over on the first flush so the sums never go back
+    global dirty, loaded, flushed
+    with lock:
+        if not dirty or suspended:
+            return
+        if not loaded:
+            merge_into(values, read_file(get_path()))
+            loaded = True
+        data = {name: [[list(key), value] for key, value in series.items()] for name, series in values.items()}
+        flushed = copy_values(values)
+        dirty = False
+
+    path = get_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        logger.exception('writing the metrics failed: %s' % path)
+
+
+atexit.register(flush)
+
+
+def discard():
+    # forgets what this process observed since the last flush, the written values stay
+    global dirty
+    with lock:
+        for name in values:
+            values[name] = copy_values({name: flushed.get(name, dict())})[name]
+        dirty = False
+
+
+@contextmanager
+def discarding():
+    # nothing observed inside is ever written, e.g. the rolled back work of the benchmark.
+    # whatever other threads observe meanwhile is dropped too
+    global suspended
+    with lock:
+        suspended += 1
+    try:
+        yield
+    finally:
+        with lock:
+            suspended -= 1
+        discard()
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # running as another user
+        return True
+
+    return True
+
+
+def collect():
+    # the values of every running process, added up. the files of the processes that have exited are removed,
+    # their counters drop out of the sums like after a restart
+    flush()
+
+    total = dict()
+    metrics_dir = get_metrics_dir()
+    try:
+        names = os.listdir(metrics_dir)
+    except OSError:
+        names = []
+    for name in sorted(names):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(metrics_dir, name)
+        pid = name[:-len('.json')]
+        if pid.isdigit() and not is_running(int(pid)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        merge_into(total, read_file(path))
+
+    return total
+
+
+def render():
+    total = collect()
+    lines = []
+    for name, metric in metric_dict.items():
+        lines.append('# HELP %s %s' % (name, metric.help))
+        lines.append('# TYPE %s %s' % (name, metric.kind))
+        lines.extend(metric.lines(total.get(name, dict())))
+
+    return '\n'.join(lines) + '\n'
+
+
+def timed_view(view):
+    # REQUEST_SECONDS of a view, until the last chunk for a streaming response
+    name = view.__name__
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        start = time.perf_counter()
+        response = view(request, *args, **kwargs)
+        if not getattr(response, 'streaming', False):
+            REQUEST_SECONDS.observe(time.perf_counter() - start, view=name)
+            flush()
+            return response
+
+        def stream(content):
+            try:
+                yield from content
+            finally:
+                REQUEST_SECONDS.observe(time.perf_counter() - start, view=name)
+                flush()
+
+        response.streaming_content = stream(response.streaming_content)
+        return response
+
+    return wrapper
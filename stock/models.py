@@ -196,3 +196,155 @@ class Order(models.Model):
 
 class OrderID(models.Model):
     order_id = models.IntegerField()
+
+
+
+class SimulationRun(models.Model):
+    created = models.DateTimeField('run creation time', auto_now_add=True)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    finished = models.BooleanField(default=False)
+
+    def __str__(self):
+        return '%d: %s - %s' % (self.id, str(self.start_date), str(self.end_date))
+
+
+class SimOrder(models.Model):
+    class Meta:
+        unique_together = (('run', 'account_id', 'symbol', 'dt'),)
+
+    run = models.ForeignKey(SimulationRun, on_delete=models.CASCADE)
+    account_id = models.IntegerField()
+    symbol = models.CharField(max_length=10)
+    dt = models.DateTimeField('order date')
+    price = models.FloatField()
+    count = models.FloatField()
+    action = models.IntegerField(choices=ACTION_CHOICE)
+    failure_reason = models.ForeignKey(FailureReason, on_delete=models.CASCADE)
+
+    def __str__(self):
+        action_string = 'unknown'
+        for en in ACTION_CHOICE:
+            if en[0] == self.action:
+                action_string = en[1]
+        return '%d: %s - %d: %s %s %f %s' % (self.run_id, str(self.dt), self.account_id, self.symbol, action_string,
+                                             self.price * self.count, self.failure_reason.message)
+
+
+class SimDayReport(models.Model):
+    class Meta:
+        unique_together = (('run', 'date', 'account_id'),)
+
+    run = models.ForeignKey(SimulationRun, on_delete=models.CASCADE)
+    date = models.DateField()
+    account_id = models.IntegerField()
+    net_value = models.FloatField()
+    cash_to_trade = models.FloatField()
+
+    def __str__(self):
+        return '%d: %d/%d/%d - %d: net %f (cash %f)' % (self.run_id, self.date.month, self.date.day, self.date.year,
+                                                        self.account_id, self.net_value, self.cash_to_trade)
+
+
+class IndicatorState(models.Model):
+    class Meta:
+        unique_together = (('kind', 'symbol', 'period'),)
+
+    kind = models.CharField(max_length=20)
+    symbol = models.CharField(max_length=10)
+    period = models.IntegerField()
+    last_date = models.DateField('date of the last bar in the state', null=True, blank=True)
+    state = models.TextField('indicator state in json')
+
+    def __str__(self):
+        return '%s %s (%d): %s' % (self.kind, self.symbol, self.period, str(self.last_date))
+
+
+class Position(models.Model):
+    class Meta:
+        unique_together = (('account_id', 'symbol'),)
+
+    account_id = models.IntegerField()
+    symbol = models.CharField(max_length=10)
+    count = models.FloatField(default=0.0)
+    avg_cost = models.FloatField('average cost of the open count', default=0.0)
+    last_buy_price = models.FloatField(null=True, blank=True)
+    last_buy_dt = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '%d: %s - count %f avg_cost %f' % (self.account_id, self.symbol, self.count, self.avg_cost)
+
+
+# the account columns of the reports are read from DayReport/SimDayReport, only the symbols have a series
+SERIES_SYMBOL = 1
+SERIES_SIM_SYMBOL = 2
+SERIES_CHOICE = (
+    (SERIES_SYMBOL, 'symbol'),
+    (SERIES_SIM_SYMBOL, 'sim_symbol'),
+)
+
+
+class PerformanceDay(models.Model):
+    class Meta:
+        unique_together = (('series', 'name', 'date'),)
+        indexes = [models.Index(fields=['series', 'date'])]
+
+    series = models.IntegerField(choices=SERIES_CHOICE)
+    name = models.CharField('symbol or account id', max_length=10)
+    date = models.DateField()
+    value = models.FloatField('net value or open of the last day at or before the date')
+    growth = models.FloatField('value over the first value of the series that is neither 0 nor 1')
+
+    def __str__(self):
+        return '%d/%d/%d - %s: value %f growth %f' % (self.date.month, self.date.day, self.date.year, self.name,
+                                                      self.value, self.growth)
+
+
+class DataVersion(models.Model):
+    # single row bumped whenever the data behind the reports changes, part of the report cache keys
+    version = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '%d' % self.version
+
+
+JOB_QUEUED = 0
+JOB_RUNNING = 1
+JOB_DONE = 2
+JOB_FAILED = 3
+JOB_STATUS_CHOICE = (
+    (JOB_QUEUED, 'queued'),
+    (JOB_RUNNING, 'running'),
+    (JOB_DONE, 'done'),
+    (JOB_FAILED, 'failed'),
+)
+
+
+class Job(models.Model):
+    kind = models.CharField(max_length=20)
+    params = models.TextField('parameters in json', default='{}')
+    status = models.IntegerField(choices=JOB_STATUS_CHOICE, default=JOB_QUEUED)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    message = models.CharField(max_length=300, blank=True, default='')
+    result = models.TextField('result in json', blank=True, default='')
+    heartbeat = models.DateTimeField('last sign of life of the worker running the job', null=True, blank=True)
+
+    def __str__(self):
+        return '%d: %s %s (%d/%d)' % (self.id, self.kind, dict(JOB_STATUS_CHOICE)[self.status],
+                                      self.progress, self.total)
+
+
+class RunTrace(models.Model):
+    # per phase timing of one run, load_history or simulate, see stock.tracing
+    kind = models.CharField(max_length=20)
+    started = models.DateTimeField()
+    seconds = models.FloatField('wall time')
+    queries = models.IntegerField('SQL queries of the calling thread')
+    spans = models.TextField('spans in json', default='[]')
+
+    def __str__(self):
+        return '%s %s: %.3fs %d queries' % (str(self.started), self.kind, self.seconds, self.queries)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import logging
+import threading
+from . import models
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+
+logger = logging.getLogger('orderids')
+
+FIRST_ORDER_ID = 500
+BLOCK_SIZE = 20
+
+
+def get_counter_id():
+    # the OrderID row of the counter, created on first use
+    counter_id = models.OrderID.objects.order_by('id').values_list('id', flat=True).first()
+    if counter_id is not None:
+        return counter_id
+
+    try:
+        with transaction.atomic():
+            return models.OrderID.objects.create(id=1, order_id=FIRST_ORDER_ID).id
+    except IntegrityError:
+        # another run created it first
+        return models.OrderID.objects.order_by('id').values_list('id', flat=True).first()
+
+
+def reserve(count=BLOCK_SIZE):
+    # the first of count order ids that no other run gets. the update comes first so the row is
+    # locked (the database write lock on sqlite) until the new value is read back and committed
+    counter_id = get_counter_id()
+    with transaction.atomic():
+        models.OrderID.objects.filter(id=counter_id).update(order_id=F('order_id') + count)
+        end = models.OrderID.objects.filter(id=counter_id).values_list('order_id', flat=True).get()
+
+    logger.debug('order ids %d - %d reserved' % (end - count, end - 1))
+
+    return end - count
+
+
+class OrderIdAllocator:
+    # hands out order ids from blocks reserved in the database, shared by the account threads of a run.
+    # the ids left in the last block are never used
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.end_id = 0
+
+    def next(self):
+        with self.lock:
+            if self.next_id >= self.end_id:
+                self.next_id = reserve(self.block_size)
+                self.end_id = self.next_id + self.block_size
+            order_id = self.next_id
+            self.next_id += 1
+
+        return order_id
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import datetime
+import logging
+import numpy as np
+from . import models
+from django.db import transaction
+from django.db.models import Max, Q, OuterRef, Subquery
+from django.utils import timezone
+
+
+logger = logging.getLogger('performance')
+
+BATCH_SIZE = 1000
+
+
+# PerformanceDay keeps one row per series and calendar day from the first value of the series to the last one:
+# the value carried forward to the day and its growth over the first value that is neither 0 nor 1.
+# a range of any length is rebased with growth / growth at the first day of the range with such a value.
+
+def get_points(series, names, since):
+    # (name, date, value) of the source rows at or after since
+    if series == models.SERIES_SYMBOL:
+        histories = models.DayHistory.objects
+    else:
+        histories = models.SimHistory.objects
+
+    return list(histories.filter(symbol__in=names, date__gte=since).values_list('symbol', 'date', 'open'))
+
+
+def get_names(series):
+    if series == models.SERIES_SYMBOL:
+        histories = models.DayHistory.objects
+    else:
+        histories = models.SimHistory.objects
+
+    return list(histories.values_list('symbol', flat=True).distinct())
+
+
+def build_rows(series, name, points, last_row, base):
+    # points: (date, value) in date order after the last row kept, base from the rows kept
+    if not points:
+        return []
+
+    values = dict(points)
+    day = timezone.timedelta(1)
+    if last_row is not None:
+        # the days between the last row and the first point carry the last value
+        date = last_row.date + day
+        value = last_row.value
+    else:
+        date = points[0][0]
+        value = None
+    last_date = points[-1][0]
+
+    rows = []
+    while date <= last_date:
+        value = values.get(date, value)
+        if base is None and value not in (0.0, 1.0):
+            base = value
+        growth = value / base if base is not None else 1.0
+        rows.append(models.PerformanceDay(series=series, name=name, date=date, value=value, growth=growth))
+        date += day
+
+    return rows
+
+
+@transaction.atomic
+def update(series, name_dates):
+    # name_dates: {name: first date with new data}. the rows of each series are rebuilt from that date
+    if not name_dates:
+        return 0
+
+    points = dict()
+    for name, date, value in get_points(series, name_dates.keys(), min(name_dates.values())):
+        if date >= name_dates[name]:
+            points.setdefault(name, []).append((date, value))
+
+    # the names starting at the same date, usually all of them, share their queries
+    since_names = dict()
+    for name, since in name_dates.items():
+        since_names.setdefault(since, []).append(name)
+
+    rows = []
+    for since, names in since_names.items():
+        days = models.PerformanceDay.objects.filter(series=series, name__in=names)
+        before = models.PerformanceDay.objects.filter(series=series, name=OuterRef('name'), date__lt=since)
+        last_rows = {row.name: row for row in days.filter(
+            date=Subquery(before.order_by('-date').values('date')[:1]))}
+        base_values = dict(days.filter(
+            date=Subquery(before.exclude(value__in=(0.0, 1.0)).order_by('date').values('date')[:1]))
+            .values_list('name', 'value'))
+
+        days.filter(date__gte=since).delete()
+        for name in names:
+            rows.extend(build_rows(series, name, sorted(points.get(name, [])), last_rows.get(name),
+                                   base_values.get(name)))
+
+    models.PerformanceDay.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    count = len(rows)
+
+    logger.debug('%d performance rows for %d names' % (count, len(name_dates)))
+
+    return count
+
+
+def update_histories(model, name_dates):
+    if model is models.DayHistory:
+        series = models.SERIES_SYMBOL
+    else:
+        series = models.SERIES_SIM_SYMBOL
+
+    # a series that was never built, like after an upgrade, is built whole by the first write
+    if name_dates and not models.PerformanceDay.objects.filter(series=series).exists():
+        logger.info('building performance series %d' % series)
+        return rebuild(series)
+
+    return update(series, name_dates)
+
+
+def clear(series, keep_names=()):
+    models.PerformanceDay.objects.filter(series=series).exclude(name__in=keep_names).delete()
+
+
+@transaction.atomic
+def rebuild(series=None):
+    if series is None:
+        series_list = [choice[0] for choice in models.SERIES_CHOICE]
+    else:
+        series_list = [series]
+
+    count = 0
+    for series in series_list:
+        clear(series)
+        count += update(series, {name: datetime.date.min for name in get_names(series)})
+
+    return count
+
+
+def load_series(series, names, start_date, n_days):
+    # values and growth by name and day of the range, forward filled. NaN before the first row of a series.
+    # only reads the rows there are, the series are built by the history writes and rebuild_performance
+    values = np.full((len(names), n_days), np.nan)
+    growth = np.full((len(names), n_days), np.nan)
+    if not names or n_days <= 0:
+        return values, growth
+
+    end_date = start_date + timezone.timedelta(n_days - 1)
+    rows = {name: row for row, name in enumerate(names)}
+
+    def fill(records):
+        for name, date, value, rate in records:
+            col = max((date - start_date).days, 0)
+            values[rows[name], col] = value
+            growth[rows[name], col] = rate
+
+    days = models.PerformanceDay.objects.filter(series=series, name__in=names)
+    fill(days.filter(date__gte=start_date, date__lte=end_date).values_list('name', 'date', 'value', 'growth'))
+
+    # a series that ended before the range carries its last row into it
+    missing = [name for name in names if np.isnan(values[rows[name], 0])]
+    if missing:
+        anchors = days.filter(name__in=missing, date__lt=start_date).values('name').annotate(last_date=Max('date'))
+        condition = Q()
+        for anchor in anchors:
+            condition |= Q(name=anchor['name'], date=anchor['last_date'])
+        if condition:
+            fill(days.filter(condition).values_list('name', 'date', 'value', 'growth'))
+
+    return forward_fill(values), forward_fill(growth)
+
+
+def forward_fill(values):
+    # NaN takes the last value on the left, stays NaN before the first value
+    n_cols = values.shape[1]
+    if not n_cols:
+        return values
+    cols = np.where(np.isnan(values), -1, np.arange(n_cols))
+    last_cols = np.maximum.accumulate(cols, axis=1)
+    filled = np.take_along_axis(values, np.maximum(last_cols, 0), axis=1)
+    filled[last_cols < 0] = np.nan
+
+    return filled
+
+
+def rebase(values, growth, bases=None):
+    # each row relative to its first day in the range with a value that is neither 0 nor 1, 1.0 until then.
+    # bases keeps the growth of those days (NaN when not found yet) for the next chunk of the same range
+    if bases is None:
+        bases = np.full(values.shape[0], np.nan)
+
+    result = np.ones(values.shape)
+    for row in range(values.shape[0]):
+        base_col = 0
+        if np.isnan(bases[row]):
+            base_cols = np.flatnonzero(~np.isnan(values[row]) & (values[row] != 0.0) & (values[row] != 1.0))
+            if not len(base_cols):
+                continue
+            base_col = base_cols[0]
+            bases[row] = growth[row, base_col]
+        result[row, base_col:] = growth[row, base_col:] / bases[row]
+
+    return result
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import logging
+from . import models
+from django.db import transaction
+
+
+logger = logging.getLogger('positions')
+
+
+def apply_order(position, action, count, price, dt):
+    if action == models.ACTION_BUY:
+        total = position.count + count
+        if total > 0:
+            position.avg_cost = (position.count * position.avg_cost + count * price) / total
+        position.count = total
+        position.last_buy_price = price
+        position.last_buy_dt = dt
+    elif action == models.ACTION_SELL:
+        position.count -= count
+        if position.count <= 0:
+            position.count = 0.0
+            position.avg_cost = 0.0
+
+
+@transaction.atomic
+def record_orders(orders):
+    # moves the positions by the orders with one read and two bulk writes, the orders applied in list order.
+    # failed orders don't move the position
+    orders = [order for order in orders if order.action in (models.ACTION_BUY, models.ACTION_SELL)]
+    if not orders:
+        return []
+
+    positions = dict()
+    for position in models.Position.objects.select_for_update().filter(
+            account_id__in=set(order.account_id for order in orders), symbol__in=set(order.symbol for order in orders)):
+        positions[(position.account_id, position.symbol)] = position
+
+    new_positions = []
+    touched = dict()
+    for order in orders:
+        key = (order.account_id, order.symbol)
+        position = positions.get(key)
+        if position is None:
+            position = models.Position(account_id=order.account_id, symbol=order.symbol)
+            positions[key] = position
+            new_positions.append(position)
+        apply_order(position, order.action, order.count, order.price, order.dt)
+        touched[key] = position
+
+    changed_positions = [position for position in touched.values() if position.pk is not None]
+    models.Position.objects.bulk_create(new_positions)
+    models.Position.objects.bulk_update(changed_positions, ['count', 'avg_cost', 'last_buy_price', 'last_buy_dt'])
+
+    return list(touched.values())
+
+
+def get_entry_price(account_id, symbol):
+    try:
+        position = models.Position.objects.get(account_id=account_id, symbol=symbol)
+    except models.Position.DoesNotExist:
+        position = None
+    if position is not None and position.last_buy_price is not None:
+        return position.last_buy_price
+
+    # orders placed before the ledger existed
+    try:
+        order = models.Order.objects.filter(
+            symbol=symbol,
+            account_id=account_id,
+            action=models.ACTION_BUY).order_by('-dt')[0]
+    except IndexError:
+        return None
+
+    return order.price
+
+
+@transaction.atomic
+def rebuild_positions():
+    models.Position.objects.all().delete()
+
+    positions = dict()
+    for order in models.Order.objects.filter(action__in=(models.ACTION_BUY, models.ACTION_SELL)).order_by('dt'):
+        key = (order.account_id, order.symbol)
+        position = positions.get(key)
+        if position is None:
+            position = models.Position(account_id=order.account_id, symbol=order.symbol)
+            positions[key] = position
+        apply_order(position, order.action, order.count, order.price, order.dt)
+
+    models.Position.objects.bulk_create(positions.values())
+    logger.info('rebuilt %d positions' % len(positions))
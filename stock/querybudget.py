@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import re
+import time
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger('querybudget')
+
+# queries of a request above this are logged as a warning
+REQUEST_QUERY_BUDGET = 50
+# a query shape run this many times in one request or job is reported as a likely N+1 pattern
+QUERY_REPEAT_THRESHOLD = 10
+# shapes listed in a log line
+QUERY_PROFILE_TOP = 5
+# characters of a query shape in a log line
+SHAPE_LENGTH = 300
+
+IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+VALUES_RE = re.compile(r'(\((?:%s, )*%s\))(?:, \((?:%s, )*%s\))+')
+UNION_RE = re.compile(r'(SELECT (?:%s, )*%s)(?: UNION ALL SELECT (?:%s, )*%s)+')
+CASE_RE = re.compile(r'(WHEN \([^()]* = %s\) THEN %s)(?: WHEN \([^()]* = %s\) THEN %s)+')
+# a shape with its rows collapsed, the batches of a bulk_create or bulk_update
+BATCH_RE = re.compile(r'^(?:INSERT .*(?:\), \.\.\.| UNION ALL \.\.\.)|UPDATE .* THEN %s \.\.\.)')
+
+
+def get_shape(sql):
+    # the sql with the parameter lists collapsed, so that the same query with other values matches
+    shape = VALUES_RE.sub(r'\1, ...', sql)
+    shape = UNION_RE.sub(r'\1 UNION ALL ...', shape)
+    shape = CASE_RE.sub(r'\1 ...', shape)
+    return IN_LIST_RE.sub('(...)', shape)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryProfile:
+    # count and time of the SQL queries of the current thread between start() and stop(), by query shape
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.wall_seconds = 0.0
+        self.shapes = dict()
+        self.wrapper = None
+        self.start_time = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            shape = get_shape(sql)
+            if shape not in self.shapes:
+                self.shapes[shape] = [0, 0.0]
+            self.shapes[shape][0] += 1
+            self.shapes[shape][1] += elapsed
+
+    def start(self):
+        self.wrapper = connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        if self.wrapper is None:
+            return
+        self.wall_seconds = time.perf_counter() - self.start_time
+        self.wrapper.__exit__(None, None, None)
+        self.wrapper = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+        return False
+
+    def get_repeated(self, threshold=None):
+        # (shape, count, seconds) run at least threshold times, the most frequent first.
+        # the batches of a bulk write repeat by design and are left out
+        if threshold is None:
+            threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', QUERY_REPEAT_THRESHOLD)
+        repeated = [(shape, count, seconds) for shape, (count, seconds) in self.shapes.items()
+                    if count >= threshold and not BATCH_RE.match(shape)]
+        repeated.sort(key=lambda item: -item[1])
+        return repeated
+
+    def get_slowest(self, top=None):
+        # (shape, count, seconds) taking the most time in total
+        if top is None:
+            top = getattr(settings, 'QUERY_PROFILE_TOP', QUERY_PROFILE_TOP)
+        slowest = [(shape, count, seconds) for shape, (count, seconds) in self.shapes.items()]
+        slowest.sort(key=lambda item: -item[2])
+        return slowest[:top]
+
+    def describe(self, shapes):
+        lines = ['%s: %d queries in %.3fs (%.3fs wall)' % (self.name, self.count, self.seconds, self.wall_seconds)]
+        for shape, count, seconds in shapes:
+            lines.append('  %5d x %.4fs %s' % (count, seconds, shape[:SHAPE_LENGTH]))
+        return '\n'.join(lines)
+
+    def log(self, budget=None):
+        # a warning with the worst shapes when over budget or repeating a shape, a debug line otherwise
+        repeated = self.get_repeated()
+        over = budget is not None and self.count > budget
+        if not over and not repeated:
+            logger.debug('%s: %d queries in %.3fs' % (self.name, self.count, self.seconds))
+            return
+
+        top = getattr(settings, 'QUERY_PROFILE_TOP', QUERY_PROFILE_TOP)
+        shapes = repeated[:top] if repeated else self.get_slowest(top)
+        if over:
+            logger.warning('over the budget of %d queries\n%s' % (budget, self.describe(shapes)))
+        else:
+            logger.warning('repeated queries\n%s' % self.describe(shapes))
+
+
+@contextmanager
+def profile(name, budget=None):
+    # for jobs and management commands: logs the queries of the block like the middleware does for a request
+    query_profile = QueryProfile(name)
+    query_profile.start()
+    try:
+        yield query_profile
+    finally:
+        query_profile.stop()
+        query_profile.log(budget)
+
+
+@contextmanager
+def query_budget(budget, name='query budget'):
+    # test helper: raises QueryBudgetExceeded when the block runs more than budget queries, e.g.
+    #   with query_budget(10 + 2 * n_stocks):
+    #       main.run(dt, client)
+    query_profile = QueryProfile(name)
+    with query_profile:
+        yield query_profile
+
+    if query_profile.count > budget:
+        shapes = query_profile.get_repeated() or query_profile.get_slowest()
+        raise QueryBudgetExceeded('%d queries over the budget of %d\n%s'
+                                  % (query_profile.count, budget, query_profile.describe(shapes)))
+
+
+class QueryProfileMiddleware:
+    # logs the requests over REQUEST_QUERY_BUDGET or repeating a query shape.
+    # a streaming response is profiled until its last chunk
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        budget = getattr(settings, 'REQUEST_QUERY_BUDGET', REQUEST_QUERY_BUDGET)
+        query_profile = QueryProfile('%s %s' % (request.method, request.path))
+        query_profile.start()
+        try:
+            response = self.get_response(request)
+        except Exception:
+            query_profile.stop()
+            raise
+
+        if not getattr(response, 'streaming', False):
+            query_profile.stop()
+            query_profile.log(budget)
+            return response
+
+        def stream(content):
+            try:
+                yield from content
+            finally:
+                query_profile.stop()
+                query_profile.log(budget)
+
+        response.streaming_content = stream(response.streaming_content)
+        return response
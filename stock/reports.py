@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import datetime
+import logging
+import numpy as np
+from .models import *
+from . import performance
+from . import cache
+from .downsample import downsample
+from django.utils import timezone
+
+
+logger = logging.getLogger('reports')
+
+CHUNK_DAYS = 366
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+
+def get_report_sources(run):
+    # a simulation run reads its own reports and the simulation history
+    if run is None:
+        account_ids = Account.objects.all().order_by('account_id').values_list('account_id', flat=True)
+        symbol_series = SERIES_SYMBOL
+    else:
+        account_ids = SimDayReport.objects.filter(run=run).order_by('account_id')\
+            .values_list('account_id', flat=True).distinct()
+        symbol_series = SERIES_SIM_SYMBOL
+
+    symbol_list = list(Stock.objects.order_by('symbol').values_list('symbol', flat=True).distinct())
+
+    return list(account_ids), symbol_series, symbol_list
+
+
+def get_account_reports(run):
+    if run is None:
+        return DayReport.objects.all()
+
+    return SimDayReport.objects.filter(run=run)
+
+
+def get_account_values(reports, account_id_list, start_date, n_days, carry=None):
+    # net values of the DayReport or SimDayReport rows by account and day, forward filled from carry
+    # (the day before). NaN before the first report, those days show 1.0 after the rebase
+    values = np.full((len(account_id_list), n_days), np.nan)
+    rows = {account_id: row for row, account_id in enumerate(account_id_list)}
+    end_date = start_date + timezone.timedelta(n_days - 1)
+
+    for account_id, date, net_value in reports.filter(account_id__in=account_id_list,
+                                                      date__gte=start_date, date__lte=end_date)\
+            .values_list('account_id', 'date', 'net_value'):
+        values[rows[account_id], (date - start_date).days] = net_value
+
+    if carry is not None and n_days:
+        values[:, 0] = np.where(np.isnan(values[:, 0]), carry, values[:, 0])
+
+    return performance.forward_fill(values)
+
+
+def get_legends(account_id_list, symbol_list):
+    legends = ['date']
+    for account_id in account_id_list:
+        legends.append('account: %d' % account_id)
+    legends += symbol_list
+
+    return legends
+
+
+def generate_report_lines(start_date, n_days, run, account_id_list, symbol_series, symbol_list,
+                          chunk_days=CHUNK_DAYS):
+    # the lines of the range, CHUNK_DAYS at a time. the bases of the series carry over the chunks.
+    # an account column starts from its first report in the range, a symbol column from its last bar before it
+    account_reports = get_account_reports(run)
+    account_bases = np.full(len(account_id_list), np.nan)
+    symbol_bases = np.full(len(symbol_list), np.nan)
+    account_carry = None
+    day = timezone.timedelta(1)
+
+    for chunk_start in range(0, n_days, chunk_days):
+        date = start_date + timezone.timedelta(chunk_start)
+        n_chunk = min(chunk_days, n_days - chunk_start)
+
+        account_values = get_account_values(account_reports, account_id_list, date, n_chunk, account_carry)
+        account_carry = account_values[:, -1]
+        account_values = performance.rebase(account_values, account_values, account_bases)
+
+        symbol_values, symbol_growth = performance.load_series(symbol_series, symbol_list, date, n_chunk)
+        symbol_missing = np.isnan(symbol_values)
+        symbol_values = performance.rebase(symbol_values, symbol_growth, symbol_bases)
+
+        account_columns = account_values.T.tolist()
+        symbol_columns = symbol_values.T.tolist()
+        missing_columns = symbol_missing.T.tolist()
+
+        for n in range(n_chunk):
+            line = ['%d/%d/%d' % (date.month, date.day, date.year)]
+            line += account_columns[n]
+            for value, missing in zip(symbol_columns[n], missing_columns[n]):
+                line.append('' if missing else value)
+            yield tuple(line)
+            date += day
+
+
+def get_report_lines(start_date, end_date, run=None):
+    # legends and a generator of the report lines, built lazily as the lines are consumed
+    account_id_list, symbol_series, symbol_list = get_report_sources(run)
+
+    n_days = (end_date - start_date).days + 1
+    if n_days < 0:
+        n_days = 0
+
+    lines = generate_report_lines(start_date, n_days, run, account_id_list, symbol_series, symbol_list)
+
+    return get_legends(account_id_list, symbol_list), lines
+
+
+def get_report_list(start_date, end_date, run=None):
+    legends, lines = get_report_lines(start_date, end_date, run)
+
+    return legends, list(lines)
+
+
+def get_cached_report_list(start_date, end_date, run=None, version=None):
+    key = cache.get_key('report', start_date, end_date, run, version)
+
+    return cache.get_or_set(key, lambda: get_report_list(start_date, end_date, run))
+
+
+def get_report_series(start_date, end_date, run=None, width=None):
+    # the report columns as chart series, each downsampled to about width points.
+    # x of a point is the day in milliseconds since the epoch
+    legends, report_list = get_cached_report_list(start_date, end_date, run)
+    if width is None:
+        width = len(report_list)
+
+    epoch_day = (start_date - datetime.date(1970, 1, 1)).days
+    series = []
+    for n, legend in enumerate(legends[1:], 1):
+        points = downsample([line[n] for line in report_list], width)
+        series.append({'name': legend,
+                       'points': [[(epoch_day + day) * MS_PER_DAY, value] for day, value in points]})
+
+    return {'start': start_date.isoformat(), 'end': end_date.isoformat(), 'series': series}
@@ -1,3 +1,271 @@
-from django.test import TestCase
+import os
+import json
+import tempfile
+import subprocess
+from django.test import TestCase, override_settings
+from django.utils import timezone
+import python_simtrade.client as simclient
+from . import main
+from . import orderids
+from . import positions
+from . import backtest
+from . import models
+from . import benchmark
+from . import downsample
+from . import history_writer
+from . import trading_calendar
+from . import metrics
+from .querybudget import query_budget, get_shape, QueryProfile
 
-# Create your tests here.
+
+RUN_DATE = timezone.datetime(year=2019, month=12, day=2).date()
+# queries of one run() of the simulation accounts, whatever the number of stocks: a fixed part and
+# the commit of every account
+RUN_QUERY_BUDGET = 30
+ACCOUNT_QUERY_BUDGET = 10
+
+
+class QueryShapeTest(TestCase):
+    def test_batches_are_not_repeated(self):
+        query_profile = QueryProfile('shapes')
+        batch = get_shape('INSERT INTO "stock_order" ("symbol", "price") VALUES (%s, %s), (%s, %s), (%s, %s)')
+        select = get_shape('SELECT "stock_stock"."id" FROM "stock_stock" WHERE "stock_stock"."symbol" = %s')
+        query_profile.shapes = {batch: [20, 0.0], select: [20, 0.0]}
+
+        self.assertEqual([shape for shape, count, seconds in query_profile.get_repeated(10)], [select])
+
+
+# the bars of the tests are in SimHistory only, not in a columnar store
+@override_settings(MARKET_DATA_DIR=None)
+class RunQueryBudgetTest(TestCase):
+    def create_stocks(self, n_stocks):
+        # n_stocks over the first two accounts of the sim client, with the bars of the year before RUN_DATE
+        db_accounts = [models.Account.objects.create(account_type=models.ACCOUNT_SIMULATION, account_id=n)
+                       for n in range(2)]
+        symbols = [benchmark.SYMBOL_FORMAT % n for n in range(n_stocks)]
+        for n, symbol in enumerate(symbols):
+            models.Stock.objects.create(account=db_accounts[n % 2], symbol=symbol, share=2.0 / n_stocks,
+                                        in_algorithm=n % 6, in_stance=1, out_algorithm=n % 5, out_stance=1)
+
+        start_date = RUN_DATE - timezone.timedelta(400)
+        history_writer.write_histories(models.SimHistory, {
+            symbol: benchmark.generate_bars(symbol, start_date, RUN_DATE + timezone.timedelta(1)) for symbol in symbols})
+        main.load_history_sim(RUN_DATE)
+
+    def run_once(self):
+        dt = timezone.datetime(year=RUN_DATE.year, month=RUN_DATE.month, day=RUN_DATE.day, hour=9, minute=31,
+                               tzinfo=timezone.get_default_timezone())
+        client = simclient.Client(simclient.new_sim_config())
+        client.login(dt)
+
+        with query_budget(RUN_QUERY_BUDGET + 2 * ACCOUNT_QUERY_BUDGET, 'run') as query_profile:
+            main.run(dt=dt, client=client)
+
+        return query_profile
+
+    def test_few_stocks(self):
+        self.create_stocks(4)
+        query_profile = self.run_once()
+
+        self.assertEqual(query_profile.get_repeated(), [])
+
+    def test_many_stocks(self):
+        self.create_stocks(32)
+        query_profile = self.run_once()
+
+        self.assertEqual(query_profile.get_repeated(), [])
+        self.assertTrue(models.Order.objects.exists())
+
+
+class BenchmarkTest(TestCase):
+    def test_generate_bars(self):
+        start_date = RUN_DATE - timezone.timedelta(60)
+        bars = benchmark.generate_bars('SYN000', start_date, RUN_DATE)
+
+        self.assertEqual(bars, benchmark.generate_bars('SYN000', start_date, RUN_DATE))
+        self.assertNotEqual(bars, benchmark.generate_bars('SYN000', start_date, RUN_DATE, seed=2))
+        dates = [bar[0] for bar in bars]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertTrue(all(trading_calendar.is_trading_day(date, 'SYN000') for date in dates))
+        self.assertTrue(all(low <= min(open, close) and max(open, close) <= high
+                            for date, open, high, low, close, volume in bars))
+
+    def test_run_case(self):
+        case = benchmark.run_case(2, 1)
+
+        self.assertGreater(case['bars'], 0)
+        self.assertGreater(case['report_lines'], 0)
+        self.assertIn('backtest', case['timings'])
+        # the case leaves the database as it was
+        self.assertFalse(models.SimHistory.objects.exists())
+        self.assertFalse(models.SimulationRun.objects.exists())
+
+        suite = {'cases': [case]}
+        for symbols, years, step, seconds, base_seconds in benchmark.compare(suite, suite):
+            self.assertEqual(seconds, base_seconds)
+
+
+@override_settings(MARKET_DATA_DIR=None)
+class BacktestTest(TestCase):
+    # the backtest against the day by day loop through run() with the sim client that simulate() used to be
+    SYMBOLS = ('SYN000', 'SYN001', 'BTC')
+    START_DATE = timezone.datetime(year=2016, month=1, day=1).date()
+    END_DATE = timezone.datetime(year=2016, month=2, day=15).date()
+
+    def setUp(self):
+        db_accounts = [models.Account.objects.create(account_type=models.ACCOUNT_SIMULATION, account_id=n)
+                       for n in range(2)]
+        for symbol in self.SYMBOLS:
+            models.Stock.objects.create(account=db_accounts[0], symbol=symbol, share=0.3, in_algorithm=5, in_stance=1,
+                                        out_algorithm=4, out_stance=1)
+            models.Stock.objects.create(account=db_accounts[1], symbol=symbol, share=0.3, in_algorithm=4, in_stance=0,
+                                        out_algorithm=3, out_stance=2)
+
+        history_start = self.START_DATE - timezone.timedelta(365)
+        history_writer.write_histories(models.SimHistory, {
+            symbol: benchmark.generate_bars(symbol, history_start, self.END_DATE + timezone.timedelta(1))
+            for symbol in self.SYMBOLS})
+
+    def run_stepwise(self):
+        cur_dt = timezone.datetime(year=self.START_DATE.year, month=self.START_DATE.month, day=self.START_DATE.day,
+                                   hour=9, minute=31, tzinfo=timezone.get_default_timezone())
+        client = simclient.Client(simclient.new_sim_config())
+        client.login(cur_dt)
+        order_ids = orderids.OrderIdAllocator()
+        # the backtest has the bars before the start from the first day on
+        main.load_history_sim(self.START_DATE - timezone.timedelta(1))
+        while cur_dt.date() <= self.END_DATE:
+            client.update(cur_dt)
+            main.run(dt=cur_dt, client=client, order_ids=order_ids)
+            main.load_history_sim(cur_dt.date())
+            cur_dt += timezone.timedelta(1)
+
+        orders = ['%s %d %s %d %.4f %.4f %s' % (order.dt.date(), order.account_id, order.symbol, order.action,
+                                                 order.price, order.count, order.failure_reason_id)
+                  for order in models.Order.objects.order_by('dt', 'account_id', 'symbol')]
+        reports = ['%s %d %.4f %.4f' % (report.date, report.account_id, report.net_value, report.cash_to_trade)
+                   for report in models.DayReport.objects.order_by('date', 'account_id')]
+
+        return orders, reports
+
+    def test_same_as_stepwise(self):
+        result, market = backtest.backtest(self.START_DATE, self.END_DATE)
+        orders = ['%s %d %s %d %.4f %.4f %s' % (order.dt.date(), order.account_id, order.symbol, order.action,
+                                                 order.price, order.count, order.failure_reason)
+                  for order in sorted(result.orders, key=lambda order: (order.dt, order.account_id, order.symbol))]
+        reports = ['%s %d %.4f %.4f' % (date, account_id, result.net_values[a, n], result.cash_to_trade[a, n])
+                   for n, date in enumerate(result.dates) for a, account_id in enumerate(result.account_ids)]
+
+        stepwise_orders, stepwise_reports = self.run_stepwise()
+
+        self.maxDiff = None
+        self.assertTrue(orders)
+        self.assertEqual(orders, stepwise_orders)
+        self.assertEqual(reports, stepwise_reports)
+
+
+class PositionTest(TestCase):
+    SYMBOL = 'SYN000'
+
+    def get_scanned_entry_price(self, account_id):
+        # the entry price as get_entry_price read it from the orders before the ledger
+        try:
+            return models.Order.objects.filter(symbol=self.SYMBOL, account_id=account_id,
+                                               action=models.ACTION_BUY).order_by('-dt')[0].price
+        except IndexError:
+            return None
+
+    def test_same_as_order_scan(self):
+        reason = models.FailureReason.objects.create(message='')
+        dt = timezone.datetime(year=2019, month=12, day=2, hour=9, minute=31, tzinfo=timezone.get_default_timezone())
+        # buy, buy more, partial sell, failed buy, sell all, buy again
+        sequence = [(models.ACTION_BUY, 10.0, 5.0), (models.ACTION_BUY, 12.0, 5.0), (models.ACTION_SELL, 13.0, 4.0),
+                    (models.ACTION_BUY_FAIL, 9.0, 3.0), (models.ACTION_SELL, 11.0, 6.0), (models.ACTION_BUY, 8.0, 2.0)]
+
+        for account_id in range(2):
+            self.assertIsNone(positions.get_entry_price(account_id, self.SYMBOL))
+
+        for n, (action, price, count) in enumerate(sequence):
+            # the second account gets its orders one day later, in a single batch at the end
+            orders = [models.Order(account_id=account_id, symbol=self.SYMBOL, dt=dt + timezone.timedelta(n + account_id),
+                                   price=price, count=count, action=action, failure_reason=reason)
+                      for account_id in range(2)]
+            models.Order.objects.bulk_create(orders)
+            positions.record_orders(orders[:1])
+
+            self.assertEqual(positions.get_entry_price(0, self.SYMBOL), self.get_scanned_entry_price(0))
+
+        positions.record_orders(list(models.Order.objects.filter(account_id=1).order_by('dt')))
+        self.assertEqual(positions.get_entry_price(1, self.SYMBOL), self.get_scanned_entry_price(1))
+        self.assertEqual(positions.get_entry_price(1, self.SYMBOL), 8.0)
+
+        position = models.Position.objects.get(account_id=0, symbol=self.SYMBOL)
+        self.assertEqual(position.count, 2.0)
+        self.assertEqual(position.avg_cost, 8.0)
+
+        positions.rebuild_positions()
+        for account_id in range(2):
+            self.assertEqual(positions.get_entry_price(account_id, self.SYMBOL), self.get_scanned_entry_price(account_id))
+
+
+class OrderIdTest(TestCase):
+    def test_allocators_do_not_overlap(self):
+        # two runs sharing the counter, taking ids in turn across several blocks
+        allocators = [orderids.OrderIdAllocator(block_size=3), orderids.OrderIdAllocator(block_size=3)]
+        ids = [[], []]
+        for n in range(10):
+            for allocator, allocated in zip(allocators, ids):
+                allocated.append(allocator.next())
+
+        for allocated in ids:
+            self.assertEqual(allocated, sorted(set(allocated)))
+            self.assertGreaterEqual(allocated[0], orderids.FIRST_ORDER_ID)
+        self.assertFalse(set(ids[0]) & set(ids[1]))
+
+
+class DownsampleTest(TestCase):
+    def test_lttb(self):
+        x = list(range(1000))
+        y = [(n * 7919) % 101 for n in x]
+        selected = downsample.lttb(x, y, 100)
+
+        self.assertEqual(len(selected), 100)
+        self.assertEqual(selected[0], 0)
+        self.assertEqual(selected[-1], 999)
+        self.assertEqual(list(selected), sorted(set(selected)))
+
+    def test_short_series(self):
+        self.assertEqual(list(downsample.lttb([0, 1, 2], [5.0, 1.0, 3.0], 10)), [0, 1, 2])
+        self.assertEqual(downsample.downsample([5.0, None, 1.0, '', 3.0], 10), [(0, 5.0), (2, 1.0), (4, 3.0)])
+
+    def test_downsample(self):
+        y = [None] * 10 + [float(n % 13) for n in range(500)]
+        points = downsample.downsample(y, 50)
+
+        self.assertEqual(len(points), 50)
+        self.assertEqual(points[0], (10, 0.0))
+        self.assertEqual(points[-1], (509, float(499 % 13)))
+
+
+class MetricsTest(TestCase):
+    def test_local_only(self):
+        # the last X-Forwarded-For entry is the one nginx appended
+        response = self.client.get('/stock/metrics/', HTTP_X_FORWARDED_FOR='127.0.0.1, 203.0.113.5')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get('/stock/metrics/', HTTP_X_FORWARDED_FOR='203.0.113.5, 127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_exited_processes_removed(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+
+        with tempfile.TemporaryDirectory() as metrics_dir, override_settings(METRICS_DIR=metrics_dir):
+            for pid in (process.pid, os.getpid()):
+                with open(os.path.join(metrics_dir, '%d.json' % pid), 'w') as f:
+                    json.dump({metrics.HISTORY_ROWS.name: [[['SimHistory'], 1.0]]}, f)
+
+            metrics.collect()
+
+            self.assertFalse(os.path.exists(os.path.join(metrics_dir, '%d.json' % process.pid)))
+            self.assertTrue(os.path.exists(os.path.join(metrics_dir, '%d.json' % os.getpid())))
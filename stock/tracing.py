@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import json
+import time
+import logging
+import threading
+from contextlib import nullcontext
+from . import models
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+
+logger = logging.getLogger('tracing')
+# one json line per finished trace, see LOGGING in settings.py.sample
+trace_logger = logging.getLogger('trace')
+
+TRACE_RUN = 'run'
+TRACE_LOAD_HISTORY = 'load_history'
+TRACE_SIMULATE = 'simulate'
+
+# traces kept in the database for the diagnostics page, older ones are deleted
+TRACES_TO_KEEP = 50
+
+
+class Span:
+    # wall time and the SQL queries of the current thread between enter and exit
+    def __init__(self, trace, name, account, symbol, algorithm):
+        self.trace = trace
+        self.key = (name, account, symbol, algorithm)
+        self.queries = 0
+        self.start = None
+        self.wrapper = None
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.wrapper = connection.execute_wrapper(self.count_query)
+        self.wrapper.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = time.perf_counter() - self.start
+        self.wrapper.__exit__(exc_type, exc_value, tb)
+        self.trace.add(self.key, elapsed, self.queries)
+        return False
+
+
+class Trace:
+    # the spans of one run(), load_history() or simulate(), summed by (name, account, symbol, algorithm).
+    # spans may be recorded from several threads
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = timezone.now()
+        self.lock = threading.Lock()
+        self.spans = dict()
+        self.total = None
+
+    def span(self, name, account=None, symbol=None, algorithm=None):
+        return Span(self, name, account, symbol, algorithm)
+
+    def add(self, key, elapsed, queries):
+        with self.lock:
+            span = self.spans.get(key)
+            if span is None:
+                span = self.spans[key] = [0, 0.0, 0]
+            span[0] += 1
+            span[1] += elapsed
+            span[2] += queries
+
+    def __enter__(self):
+        self.total = self.span('total')
+        self.total.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.total.__exit__(exc_type, exc_value, tb)
+        try:
+            self.save()
+        except Exception:
+            logger.exception('storing the trace failed')
+        return False
+
+    def get_span_list(self):
+        # the slowest spans first
+        span_list = []
+        with self.lock:
+            for (name, account, symbol, algorithm), (count, elapsed, queries) in self.spans.items():
+                span_list.append({'name': name, 'account': account, 'symbol': symbol, 'algorithm': algorithm,
+                                  'count': count, 'seconds': round(elapsed, 6), 'queries': queries})
+        span_list.sort(key=lambda span: -span['seconds'])
+        return span_list
+
+    def to_dict(self):
+        count, elapsed, queries = self.spans.get(('total', None, None, None), (0, 0.0, 0))
+        return {'kind': self.kind,
+                'started': self.started.isoformat(),
+                'seconds': round(elapsed, 6),
+                'queries': queries,
+                'spans': self.get_span_list()}
+
+    def save(self):
+        trace_dict = self.to_dict()
+        trace_logger.info(json.dumps(trace_dict))
+
+        models.RunTrace.objects.create(kind=self.kind, started=self.started, seconds=trace_dict['seconds'],
+                                       queries=trace_dict['queries'], spans=json.dumps(trace_dict['spans']))
+        delete_old_traces()
+
+
+def span(trace, name, account=None, symbol=None, algorithm=None):
+    # a span of trace, nothing when there is no trace
+    if trace is None:
+        return nullcontext()
+    return trace.span(name, account, symbol, algorithm)
+
+
+def delete_old_traces(keep=None):
+    if keep is None:
+        keep = getattr(settings, 'TRACES_TO_KEEP', TRACES_TO_KEEP)
+
+    old_ids = list(models.RunTrace.objects.order_by('-id').values_list('id', flat=True)[keep:])
+    if old_ids:
+        models.RunTrace.objects.filter(id__in=old_ids).delete()
+
+
+def get_recent_traces(count):
+    traces = []
+    for db_trace in models.RunTrace.objects.order_by('-id')[:count]:
+        try:
+            spans = json.loads(db_trace.spans)
+        except ValueError:
+            spans = []
+        traces.append({'trace': db_trace, 'spans': spans})
+
+    return traces
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+# no django here, is_holiday.py uses this module from cron
+
+import datetime
+import holidays
+from functools import lru_cache
+
+
+ASSET_EQUITY = 'equity'
+ASSET_CRYPTO = 'crypto'
+
+CRYPTO_SYMBOLS = ('BTC',)
+
+
+def get_asset_class(symbol):
+    if symbol in CRYPTO_SYMBOLS:
+        return ASSET_CRYPTO
+
+    return ASSET_EQUITY
+
+
+@lru_cache(maxsize=None)
+def get_holidays(year):
+    # exchange holidays when the holidays package knows them, the federal ones otherwise
+    if hasattr(holidays, 'NYSE'):
+        return frozenset(holidays.NYSE(years=year).keys())
+
+    return frozenset(holidays.UnitedStates(years=year).keys())
+
+
+@lru_cache(maxsize=None)
+def get_trading_days(year, asset_class):
+    first = datetime.date(year, 1, 1)
+    days = [first + datetime.timedelta(n) for n in range((datetime.date(year + 1, 1, 1) - first).days)]
+    if asset_class == ASSET_CRYPTO:
+        return frozenset(days)
+
+    market_holidays = get_holidays(year)
+
+    return frozenset(day for day in days if day.weekday() < 5 and day not in market_holidays)
+
+
+def is_holiday(date):
+    return date in get_holidays(date.year)
+
+
+def is_trading_day(date, symbol=None, asset_class=None):
+    # for the symbol, or the asset class (equities by default)
+    if asset_class is None:
+        asset_class = get_asset_class(symbol) if symbol is not None else ASSET_EQUITY
+
+    return date in get_trading_days(date.year, asset_class)
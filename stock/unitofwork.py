@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Owen Kwon, hereby disclaims all copyright interest in the program "myetrade_django" written by Owen (Ohkeun) Kwon.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import logging
+import threading
+from . import models
+from . import positions
+from . import metrics
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+
+logger = logging.getLogger('unitofwork')
+
+BATCH_SIZE = 500
+
+# messages known to have a FailureReason row, shared by the runs of the process
+failure_reasons = set()
+failure_reasons_lock = threading.Lock()
+
+
+@receiver(post_delete, sender=models.FailureReason)
+def on_failure_reason_deleted(sender, **kwargs):
+    with failure_reasons_lock:
+        failure_reasons.clear()
+
+
+def remember_failure_reasons(messages):
+    with failure_reasons_lock:
+        failure_reasons.update(messages)
+
+
+def store_failure_reasons(messages):
+    # creates the FailureReason rows the cache doesn't know about yet. they are cached once the transaction
+    # commits, a rolled back one must not leave messages in the cache without their rows
+    with failure_reasons_lock:
+        missing = set(messages) - failure_reasons
+    if not missing:
+        return
+
+    existing = set(models.FailureReason.objects.filter(message__in=missing).values_list('message', flat=True))
+    models.FailureReason.objects.bulk_create([models.FailureReason(message=message) for message in missing - existing],
+                                             batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    transaction.on_commit(lambda: remember_failure_reasons(missing))
+
+
+class UnitOfWork:
+    # the database changes of the accounts added, written by commit() with a few bulk queries in one transaction
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.orders = []
+        self.db_stocks = []
+        self.db_accounts = []
+        self.reports = []
+
+    def add_account(self, db_account, dt, orders, db_stocks):
+        # the orders, the updated Stock rows and the new values of db_account, reported on dt
+        report = models.DayReport(date=dt.date(), account=db_account, net_value=db_account.net_value,
+                                  cash_to_trade=db_account.cash_to_trade)
+        with self.lock:
+            self.orders.extend(orders)
+            self.db_stocks.extend(db_stocks)
+            self.db_accounts.append(db_account)
+            self.reports.append(report)
+
+    @transaction.atomic
+    def commit(self):
+        with self.lock:
+            orders, self.orders = self.orders, []
+            db_stocks, self.db_stocks = self.db_stocks, []
+            db_accounts, self.db_accounts = self.db_accounts, []
+            reports, self.reports = self.reports, []
+
+        store_failure_reasons(order.failure_reason_id for order in orders)
+        models.Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+        positions.record_orders(orders)
+
+        models.Stock.objects.bulk_update(db_stocks, ['count', 'last_count'], batch_size=BATCH_SIZE)
+        models.Account.objects.bulk_update(db_accounts, ['net_value', 'cash_to_trade'], batch_size=BATCH_SIZE)
+
+        # a run repeated on the same day replaces the reports of the day
+        if reports:
+            models.DayReport.objects.filter(account__in=[report.account for report in reports],
+                                            date__in=set(report.date for report in reports)).delete()
+        models.DayReport.objects.bulk_create(reports, batch_size=BATCH_SIZE)
+
+        for order in orders:
+            failed = order.action in (models.ACTION_BUY_FAIL, models.ACTION_SELL_FAIL)
+            metrics.ORDERS.inc(result='failed' if failed else 'placed', reason=order.failure_reason_id)
+
+        logger.debug('stored %d orders, %d stocks, %d accounts' % (len(orders), len(db_stocks), len(db_accounts)))
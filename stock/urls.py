@@ -21,6 +21,9 @@ from . import views
 
 
 urlpatterns = [
+    url(r'report_series/(?P<s_year>.{4})(?P<s_month>.{2})(?P<s_day>.{2})'
+        r'-(?P<e_year>.{4})(?P<e_month>.{2})(?P<e_day>.{2})',
+        views.report_series_page),
     url(r'report_range/(?P<s_year>.{4})(?P<s_month>.{2})(?P<s_day>.{2})'
         r'-(?P<e_year>.{4})(?P<e_month>.{2})(?P<e_day>.{2})',
         views.report_range_page),
@@ -31,6 +34,9 @@ urlpatterns = [
     path('simulate/', views.simulate_page),
     path('loaddata/', views.load_data_page),
     path('run/', views.run_page),
+    path('job/<int:job_id>/', views.job_page),
+    path('diagnostics/', views.diagnostics_page),
+    path('metrics/', views.metrics_page),
     path('logout/', views.logout_page),
     path('login/', views.login_page),
     path('', views.index, name='index'),
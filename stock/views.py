@@ -15,134 +15,66 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
 
+import json
 import logging
 import csv
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
-import mpld3
 from . import main
+from . import backtest
+from . import cache
+from . import jobs
+from . import tracing
+from . import metrics
+from .reports import get_report_list, get_report_lines, get_report_series, get_cached_report_list
 from .forms import *
 from .models import *
 from django.contrib.auth import authenticate, login, logout
 from django.template import loader, Context
 from django.shortcuts import redirect, render
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from os.path import realpath, dirname
 
 CUR_DIR = dirname(realpath(__file__))
 
+DEFAULT_CHART_WIDTH = 800
+MAX_CHART_WIDTH = 4000
+DEFAULT_DIAGNOSTICS_RUNS = 10
 
-def get_report_list(start_date, end_date):
-    report_list = []
-    account_id_list = []
-    symbol_list = []
-
-    for account in Account.objects.all().order_by('account_id'):
-        account_id_list.append(account.account_id)
-
-    for stock in Stock.objects.all().order_by('symbol'):
-        if str(stock.symbol) not in symbol_list:
-            symbol_list.append(str(stock.symbol))
-
-    prev_line = (0.0, ) * (1 + len(account_id_list) + len(symbol_list))
-    base_values = [0.0, ] * (len(account_id_list) + len(symbol_list))
-
-    day = timezone.timedelta(1)
-    date = start_date
-    while date <= end_date:
-        line = list()
-        line.append('%d/%d/%d' % (date.month, date.day, date.year))
-        col = 1
-        for account_id in account_id_list:
-            try:
-                day_report = DayReport.objects.filter(account_id=account_id, date=date)[0]
-                val = float(day_report.net_value)
-            except IndexError:
-                val = prev_line[col] * base_values[col - 1]
-
-            if base_values[col - 1] == 0.0 and val != 1.0:
-                base_values[col - 1] = val
-            if base_values[col - 1]:
-                line.append(val / base_values[col - 1])
-            else:
-                line.append(1.0)
-            col += 1
-
-        for symbol in symbol_list:
-            try:
-                history = DayHistory.objects.filter(symbol=symbol, date__lte=date).order_by('-date')[0]
-                val = float(history.open)
-            except IndexError:
-                val = None
-            if base_values[col - 1] == 0.0 and val != 1.0 and val is not None:
-                base_values[col - 1] = val
-            if val is None:
-                line.append('')
-            elif base_values[col - 1]:
-                line.append(val / base_values[col - 1])
-            else:
-                line.append(1.0)
-            col += 1
-
-        line_tuple = tuple(line)
-        report_list.append(line_tuple)
-        prev_line = line_tuple
-        date += day
 
-    legends = ['date']
-    for account_id in account_id_list:
-        legends.append('account: %d' % account_id)
-    legends += symbol_list
+class Echo:
+    # file-like object for csv.writer that hands each row back instead of buffering it
+    def write(self, value):
+        return value
 
-    return legends, report_list
 
+def stream_csv(legends, lines):
+    writer = csv.writer(Echo())
+    yield writer.writerow(legends)
+    for line in lines:
+        yield writer.writerow(line)
 
-def get_html_fig(legends, report_list):
-    data_list = list()
-    for legend in legends:
-        data_list.append(list())
-
-    for line in report_list:
-        for n in range(len(line)):
-            if n == 0:
-                spl = line[n].split('/')
-                date = timezone.datetime(year=int(spl[2]), month=int(spl[0]), day=int(spl[1])).date()
-                data_list[0].append(date)
-            else:
-                if line[n]:
-                    data_list[n].append(line[n])
-                else:
-                    data_list[n].append(None)
 
-    mpl.rcParams['axes.edgecolor'] = 'black'
-    mpl.rcParams['axes.facecolor'] = 'white'
-    mpl.rcParams['figure.facecolor'] = 'white'
-    mpl.rcParams['figure.edgecolor'] = 'white'
-    mpl.rcParams['figure.autolayout'] = 'True'
-    mpl.rcParams['axes.formatter.use_locale'] = 'True'
-    mpl.rcParams['savefig.edgecolor'] = 'white'
-    mpl.rcParams['savefig.facecolor'] = 'white'
+def get_run_in_get(get):
+    try:
+        return SimulationRun.objects.get(id=int(get['run']))
+    except (KeyError, ValueError, SimulationRun.DoesNotExist):
+        return None
 
-    fig, ax = plt.subplots()
 
-    font = {'size': 10}
-    mpl.rc('font', **font)
-    fig.patch.set_alpha(1)
+def get_int_in_post(field, post):
+    try:
+        return int(post[field])
+    except (KeyError, ValueError):
+        return None
 
-    for n in range(1, len(data_list)):
-        ax.plot_date(data_list[0], data_list[n], linestyle='solid', marker='', label=legends[n])
-    ax.grid(True)
-    legend = ax.legend(loc='upper left', shadow=True)
-    frame = legend.get_frame()
-    frame.set_facecolor('0.90')
 
-    fig.autofmt_xdate()
-    fig_html = mpld3.fig_to_html(fig)
+def get_chart_width(get):
+    width = get_int_in_post('width', get)
+    if width is None:
+        return DEFAULT_CHART_WIDTH
 
-    return fig_html
+    return max(3, min(width, MAX_CHART_WIDTH))
 
 
 def check_fields_in_post(fields, post):
@@ -194,6 +126,7 @@ def logout_page(request):
     return redirect('/stock/')
 
 
+@metrics.timed_view
 def report_range_page(request, s_year, s_month, s_day, e_year, e_month, e_day):
     if not request.user.is_authenticated:
         return redirect('/stock/')
@@ -201,20 +134,33 @@ def report_range_page(request, s_year, s_month, s_day, e_year, e_month, e_day):
     start_dt = timezone.datetime(year=int(s_year), month=int(s_month), day=int(s_day))
     end_dt = timezone.datetime(year=int(e_year), month=int(e_month), day=int(e_day))
 
-    legends, report_list = get_report_list(start_dt.date(), end_dt.date())
+    run = get_run_in_get(request.GET)
+
+    # a report the graph page already built comes from the cache, anything else is built while streaming
+    cached = cache.lookup(cache.get_key('report', start_dt.date(), end_dt.date(), run))
+    if cached is not None:
+        legends, lines = cached
+    else:
+        legends, lines = get_report_lines(start_dt.date(), end_dt.date(), run)
 
     filename = 'report_%d%2.2d%2.2d_%d%2.2d%2.2d.csv' % (start_dt.year, start_dt.month, start_dt.day,
                                                          end_dt.year, end_dt.month, end_dt.day)
-    response = HttpResponse(content_type='text/csv')
+    response = StreamingHttpResponse(stream_csv(legends, lines), content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename="%s"' % filename
 
-    writer = csv.writer(response)
-    writer.writerow(legends)
+    return response
 
-    for line in report_list:
-        writer.writerow(line)
 
-    return response
+def report_series_page(request, s_year, s_month, s_day, e_year, e_month, e_day):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'not logged in'}, status=403)
+
+    start_date = timezone.datetime(year=int(s_year), month=int(s_month), day=int(s_day)).date()
+    end_date = timezone.datetime(year=int(e_year), month=int(e_month), day=int(e_day)).date()
+
+    run = get_run_in_get(request.GET)
+
+    return JsonResponse(get_report_series(start_date, end_date, run, get_chart_width(request.GET)))
 
 
 def report_page(request):
@@ -240,74 +186,137 @@ def load_data_page(request):
     if not request.user.is_authenticated:
         return redirect('/stock/')
 
-    main.load_history(simulate=True)
+    job = jobs.enqueue(jobs.JOB_LOAD_HISTORY, simulate=True)
 
-    return render(request, 'stock/success.txt', {})
+    return render(request, 'stock/job.html', {'job': job})
 
 
-@csrf_exempt
-def run_page(request):
+def get_diagnostics_count(get):
+    count = get_int_in_post('n', get)
+    if count is None:
+        return DEFAULT_DIAGNOSTICS_RUNS
+
+    return max(1, count)
+
+
+def diagnostics_page(request):
+    if not request.user.is_staff:
+        return redirect('/stock/')
+
+    traces = tracing.get_recent_traces(get_diagnostics_count(request.GET))
+
+    return render(request, 'stock/diagnostics.html', {'traces': traces})
+
+
+def metrics_page(request):
+    if not request.user.is_authenticated and get_client_ip(request) != '127.0.0.1':
+        return HttpResponse('not logged in', status=403, content_type='text/plain')
+
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def get_client_ip(request):
+    # nginx appends the address it got the request from to X-Forwarded-For (proxy_params), the entries
+    # before it come from the client and can be anything
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
     if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
+        return x_forwarded_for.split(',')[-1].strip()
+
+    return request.META.get('REMOTE_ADDR')
+
 
-    if ip != '127.0.0.1':
+@csrf_exempt
+def run_page(request):
+    if get_client_ip(request) != '127.0.0.1':
         return render(request, 'stock/error.txt', {})
 
-    main.load_history(simulate=False)
+    job = jobs.enqueue(jobs.JOB_RUN)
+
+    return JsonResponse(jobs.get_status(job), status=202)
+
 
-    result = main.run()
-    if result:
-        return render(request, 'stock/success.txt', {})
+def job_page(request, job_id):
+    if not request.user.is_authenticated and get_client_ip(request) != '127.0.0.1':
+        return JsonResponse({'error': 'not logged in'}, status=403)
+
+    try:
+        job = Job.objects.get(id=job_id)
+    except Job.DoesNotExist:
+        return JsonResponse({'error': 'no such job'}, status=404)
+
+    return JsonResponse(jobs.get_status(job))
+
+
+def get_job_in_get(get):
+    try:
+        return Job.objects.get(id=int(get['job']))
+    except (KeyError, ValueError, Job.DoesNotExist):
+        return None
+
+
+def get_simulation_url(job):
+    return '/stock/simulate/?job=%d' % job.id
+
+
+def render_simulation_job(request, job):
+    params = json.loads(job.params)
+    initial_dict = {'start_date': jobs.parse_date(params.get('start_date')),
+                    'end_date': jobs.parse_date(params.get('end_date')),
+                    'sweep': job.kind == jobs.JOB_SWEEP}
+    form = SimulateForm(initial=initial_dict)
+
+    if job.status != JOB_DONE:
+        return render(request, 'stock/simulate.html', {'form': form,
+                                                       'job': job,
+                                                       'done_url': get_simulation_url(job)})
+
+    result = jobs.get_result(job)
+    if job.kind == jobs.JOB_SWEEP:
+        sweep_list = [backtest.SweepResult(tuple(sweep['combination']), sweep['net_value'], sweep['drawdown'],
+                                           sweep['trade_count']) for sweep in result['sweep']]
+
+        return render(request, 'stock/simulate.html', {'form': form,
+                                                       'sweep_list': sweep_list})
+
+    try:
+        run = SimulationRun.objects.get(id=result['run'])
+    except (KeyError, TypeError, SimulationRun.DoesNotExist):
+        return render(request, 'stock/simulate.html', {'form': form})
+
+    start_date = initial_dict['start_date'] or run.start_date
+    end_date = initial_dict['end_date'] or run.end_date
+    legends, report_list = get_report_list(start_date, end_date, run)
+    report_url = '%4.4d%2.2d%2.2d-%4.4d%2.2d%2.2d' % (start_date.year, start_date.month, start_date.day,
+                                                      end_date.year, end_date.month, end_date.day)
+    report_url += '?run=%d' % run.id
+    if report_list:
+        body_list = list()
+        body_list.append(report_list[-1][0])
+        for f_value in report_list[-1][1:]:
+            if f_value:
+                body_list.append('%.3f' % f_value)
+            else:
+                body_list.append('')
     else:
-        return render(request, 'stock/error.txt', {})
+        body_list = None
+
+    return render(request, 'stock/simulate.html', {'form': form,
+                                                   'report_url': report_url,
+                                                   'head_list': legends,
+                                                   'body_list': body_list})
+
 
+@metrics.timed_view
 def simulate_page(request):
     if not request.user.is_authenticated:
         return redirect('/stock/')
 
     if request.method == 'POST':
-        try:
-            in_algorithm = int(request.POST['in_algorithm'])
-        except ValueError:
-            in_algorithm = None
-        if in_algorithm is not None:
-            logging.info('in_algorithm %d' % in_algorithm)
-            for stock in Stock.objects.all():
-                stock.in_algorithm = in_algorithm
-                stock.save()
-
-        try:
-            in_stance = int(request.POST['in_stance'])
-        except ValueError:
-            in_stance = None
-        if in_stance is not None:
-            logging.info('in_stance %d' % in_stance)
-            for stock in Stock.objects.all():
-                stock.in_stance = in_stance
-                stock.save()
-
-        try:
-            out_algorithm = int(request.POST['out_algorithm'])
-        except ValueError:
-            out_algorithm = None
-        if out_algorithm is not None:
-            logging.info('out_algorithm %d' % out_algorithm)
-            for stock in Stock.objects.all():
-                stock.out_algorithm = out_algorithm
-                stock.save()
-
-        try:
-            out_stance = int(request.POST['out_stance'])
-        except ValueError:
-            out_stance = None
-        if out_stance is not None:
-            logging.info('out_stance %d' % out_stance)
-            for stock in Stock.objects.all():
-                stock.out_stance = out_stance
-                stock.save()
+        in_algorithm = get_int_in_post('in_algorithm', request.POST)
+        in_stance = get_int_in_post('in_stance', request.POST)
+        out_algorithm = get_int_in_post('out_algorithm', request.POST)
+        out_stance = get_int_in_post('out_stance', request.POST)
+        sweep = 'sweep' in request.POST
 
         start_month = int(request.POST['start_date_month'])
         start_day = int(request.POST['start_date_day'])
@@ -319,38 +328,39 @@ def simulate_page(request):
         start_date = timezone.datetime(year=start_year, month=start_month, day=start_day).date()
         end_date = timezone.datetime(year=end_year, month=end_month, day=end_day).date()
 
-        main.simulate(start_date, end_date)
-
         form = SimulateForm(initial={'start_date': start_date,
                                      'end_date': end_date,
                                      'in_algorithm': in_algorithm,
                                      'in_stance': in_stance,
                                      'out_algorithm': out_algorithm,
                                      'out_stance': out_stance,
+                                     'sweep': sweep,
                                      })
-        legends, report_list = get_report_list(start_date, end_date)
-        fig_html = get_html_fig(legends, report_list)
-        report_url = '%4.4d%2.2d%2.2d-%4.4d%2.2d%2.2d' % (start_date.year, start_date.month, start_date.day,
-                                                          end_date.year, end_date.month, end_date.day)
-        if report_list:
-            body_list = list()
-            body_list.append(report_list[-1][0])
-            for f_value in report_list[-1][1:]:
-                if f_value:
-                    body_list.append('%.3f' % f_value)
-                else:
-                    body_list.append('')
+
+        if sweep:
+            combinations = backtest.get_combinations(
+                None if in_algorithm is None else [in_algorithm],
+                None if in_stance is None else [in_stance],
+                None if out_algorithm is None else [out_algorithm],
+                None if out_stance is None else [out_stance])
+            job = jobs.enqueue(jobs.JOB_SWEEP, start_date=start_date.isoformat(), end_date=end_date.isoformat(),
+                               combinations=[list(combination) for combination in combinations])
         else:
-            body_list = None
+            # the choices go with the job, the stocks of the live accounts keep their own
+            job = jobs.enqueue(jobs.JOB_SIMULATE, start_date=start_date.isoformat(), end_date=end_date.isoformat(),
+                               in_algorithm=in_algorithm, in_stance=in_stance, out_algorithm=out_algorithm,
+                               out_stance=out_stance)
 
         return render(request, 'stock/simulate.html', {'form': form,
-                                                       'figure': fig_html,
-                                                       'report_url': report_url,
-                                                       'head_list': legends,
-                                                       'body_list': body_list})
+                                                       'job': job,
+                                                       'done_url': get_simulation_url(job)})
     else:
+        job = get_job_in_get(request.GET)
+        if job is not None and job.kind in (jobs.JOB_SIMULATE, jobs.JOB_SWEEP):
+            return render_simulation_job(request, job)
+
         form = SimulateForm()
-        return render(request, 'stock/simulate.html', {'form': form, 'figure': None})
+        return render(request, 'stock/simulate.html', {'form': form})
 
 
 def test_page(request):
@@ -362,6 +372,7 @@ def test_page(request):
     return render(request, 'stock/success.txt', {})
 
 
+@metrics.timed_view
 def graph_page(request):
     if not request.user.is_authenticated:
         return redirect('/stock/')
@@ -371,7 +382,7 @@ def graph_page(request):
         end_month = int(request.POST['end_date_month'])
         end_day = int(request.POST['end_date_day'])
         days = int(request.POST['days'])
-        end_date = timezone.datetime(year=end_year, month=end_month, day=end_day)
+        end_date = timezone.datetime(year=end_year, month=end_month, day=end_day).date()
     else:
         end_date = timezone.now().date()
         days = 30
@@ -382,8 +393,7 @@ def graph_page(request):
     initial_dict['days'] = '%d' % days
     form = GraphRangeForm(initial=initial_dict)
 
-    legends, report_list = get_report_list(start_date, end_date)
-    fig_html = get_html_fig(legends, report_list)
+    legends, report_list = get_cached_report_list(start_date, end_date)
     report_url = '%4.4d%2.2d%2.2d-%4.4d%2.2d%2.2d' % (start_date.year, start_date.month, start_date.day,
                                                       end_date.year, end_date.month, end_date.day)
     if report_list:
@@ -398,7 +408,6 @@ def graph_page(request):
         body_list = None
 
     return render(request, 'stock/graph.html', {'form': form,
-                                                'figure': fig_html,
                                                 'report_url': report_url,
                                                 'head_list': legends,
                                                 'body_list': body_list})